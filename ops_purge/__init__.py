@@ -0,0 +1,10 @@
+"""
+ops_purge: purge of old files (config sections of ops_files_purge_exceptions.cfg) and old directories (dirs_to_del_list)
+Library use: ops_purge.Purger(base_path='/adbadmin/rrsolomo/', purge_workers=4).run()
+Daemon: ops_purge.PurgeDaemon(ops_purge.Purger(...)).run() or python -m ops_purge --daemon
+Command line: python -m ops_purge --help
+"""
+from ops_purge.daemon import PurgeDaemon
+from ops_purge.purger import Purger
+
+__all__ = ['Purger', 'PurgeDaemon']
@@ -0,0 +1,5 @@
+import sys
+
+from ops_purge.cli import main
+
+sys.exit(main())
@@ -0,0 +1,70 @@
+####################################################################################################################################
+# Description:                                                                                                                     #
+#               Command line of ops_purge. Without options it runs the purge with the engine defaults (/adbadmin/rrsolomo),        #
+#               exactly like the cron entries running purging_files.py always did                                                  #
+# Usage:                                                                                                                           #
+#               python -m ops_purge                                                                                                #
+#               python -m ops_purge --base-path /adbadmin/rrsolomo --dirs /adbadmin/rrsolomo --workers 4 --log-mode summary       #
+#               python -m ops_purge --check-config                                                                                 #
+#               python -m ops_purge --set 'disk_pressure=true' --set 'free_space_target=0.2' --json                               #
+#               python -m ops_purge --daemon --rescan-interval 86400                                                               #
+####################################################################################################################################
+
+import argparse
+import logging
+import json
+
+from ops_purge.daemon import PurgeDaemon
+from ops_purge.purger import Purger, settings
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='ops_purge',description='Purge old files and directories as configured in ops_files_purge_exceptions.cfg')
+    parser.add_argument('--base-path',help='directory holding ops_files_purge_exceptions.cfg, the log and the other purge files')
+    parser.add_argument('--config',dest='config_file',help='exceptions config (default: BASE_PATH/ops_files_purge_exceptions.cfg)')
+    parser.add_argument('--rules',dest='rules_file',help='rule table (default: BASE_PATH/ops_files_purge_rules.cfg)')
+    parser.add_argument('--log-file',dest='log_file_path',help='log file (default: BASE_PATH/ops_files_purge.log)')
+    parser.add_argument('--dirs',dest='dirs_to_del_list',nargs='+',help='roots probed for old directories')
+    parser.add_argument('--workers',dest='purge_workers',type=int,help='sections and top-level subtrees purged concurrently')
+    parser.add_argument('--mode',dest='purge_mode',choices=['execute','plan','apply'],help='execute, plan only or apply a saved plan')
+    parser.add_argument('--log-mode',dest='log_mode',choices=['full','summary'],help='full listings or counts and samples')
+    parser.add_argument('--async',dest='async_mode',action='store_true',default=None,help='asyncio mode for network filesystems')
+    parser.add_argument('--metrics',dest='metrics_path',help='write the run metrics to this file (e.g. a node_exporter textfile collector .prom file)')
+    parser.add_argument('--metrics-format',dest='metrics_format',choices=['prometheus','json'],help='format of --metrics (default: prometheus)')
+    parser.add_argument('--throttle-ops',dest='throttle_ops_per_sec',type=float,help='at most this many unlink/rmdir calls per second')
+    parser.add_argument('--throttle-bytes',dest='throttle_bytes_per_sec',type=float,help='at most this many bytes freed per second')
+    parser.add_argument('--shards',dest='shard_count',type=int,help='split the purge into this many shards shared by the hosts running it (lease files in BASE_PATH/ops_files_purge.shards)')
+    parser.add_argument('--set',dest='extra',action='append',default=[],metavar='NAME=JSON',help='any other purge setting, e.g. rmtree_threads=8')
+    parser.add_argument('--check-config',action='store_true',help='validate the configuration and the rule table, save the compiled configuration and exit without purging')
+    parser.add_argument('--json',action='store_true',help='print the results as JSON')
+    parser.add_argument('--daemon',action='store_true',help='purge continuously: watch the sections and dirs with inotify and delete items as they expire')
+    parser.add_argument('--rescan-interval',type=float,default=86400,help='seconds between the full rescans of --daemon (default: 86400)')
+    return parser.parse_args(argv)
+
+"""
+job_settings(args): Purger settings of the parsed command line
+return: dict
+"""
+def job_settings(args):
+    job = dict((name, value) for name, value in vars(args).items() if name in settings and value is not None)
+    for extra in args.extra:
+        name, _, value = extra.partition('=')
+        if name not in settings:
+            raise SystemExit('ops_purge: unknown setting %s' % name)
+        try:
+            job[name] = json.loads(value)
+        except ValueError:
+            job[name] = value
+    return job
+
+def main(argv=None):
+    args = parse_args(argv)
+    purger = Purger(**job_settings(args))
+    if args.check_config:
+        logging.basicConfig(level=logging.INFO,format='%(levelname)-8s - %(message)s')
+        return purger.check_config()
+    if args.daemon:
+        return PurgeDaemon(purger,rescan_interval=args.rescan_interval).run()
+    result = purger.run()
+    if args.json:
+        print(json.dumps(result, indent=1, sort_keys=True))
+    return 0
@@ -0,0 +1,401 @@
+####################################################################################################################################
+# Description:                                                                                                                     #
+#               PurgeDaemon: continuous purge driven by Linux inotify instead of a cron run re-scanning every tree                 #
+#               1. A full purge (engine.run_purge()) runs at start, then the config sections and the dirs_to_del_list trees are    #
+#                  watched and every file/directory a rule could delete is queued by the time it expires (mtime + min_age)         #
+#               2. Items are deleted as they expire, after a fresh lstat; anything modified since it was queued is queued again    #
+#               3. An inotify queue overflow, a watch limit (fs.inotify.max_user_watches) or an expiry queue above max_queued      #
+#                  falls back to full rescans, which also run every rescan_interval seconds as a safety net                        #
+#               4. The throttle and the audit stream stay open for the life of the daemon. The metrics of a rescan are written     #
+#                  again, with the deletes made since, after every batch of expiries                                               #
+# Usage:                                                                                                                           #
+#               python -m ops_purge --daemon --rescan-interval 86400                                                               #
+#               PurgeDaemon(Purger(base_path='/adbadmin/rrsolomo/')).run()                                                         #
+####################################################################################################################################
+
+import ctypes
+import ctypes.util
+import errno
+import heapq
+import itertools
+import os
+import select
+import signal
+import stat
+import struct
+import threading
+import time
+
+from ops_purge import engine
+
+"""
+Variable Declaration
+Masks of the inotify(7) events used by the daemon (see <sys/inotify.h>)
+"""
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+watch_mask = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+event_header = struct.Struct('iIII')
+
+"""
+Inotify(): Minimal ctypes binding of inotify_init1/inotify_add_watch/inotify_rm_watch from libc. Watches are kept by path
+add_watch(path): Watches the directory path (mask watch_mask)
+remove_watch(path): Stops watching path
+read(timeout): Waits up to timeout seconds for events
+return: list of (directory path, mask, name) events; the directory path is None for IN_Q_OVERFLOW
+"""
+class Inotify(object):
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, 'inotify_init1: %s' % os.strerror(error))
+        self.paths = {}
+        self.watches = {}
+
+    def add_watch(self,path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), watch_mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        self.paths[wd] = path
+        self.watches[path] = wd
+        return wd
+
+    def remove_watch(self,path):
+        wd = self.watches.pop(path, None)
+        if wd is not None:
+            self.paths.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self,timeout):
+        if not select.select([self.fd], [], [], max(0, timeout))[0]:
+            return []
+        try:
+            data = os.read(self.fd, 256*1024)
+        except BlockingIOError:
+            return []
+        events, offset = [], 0
+        while offset < len(data):
+            wd, mask, cookie, length = event_header.unpack_from(data, offset)
+            name = os.fsdecode(data[offset+event_header.size:offset+event_header.size+length].rstrip(b'\0'))
+            offset += event_header.size+length
+            path = self.paths.get(wd)
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+                if path is not None and self.watches.get(path) == wd:
+                    del self.watches[path]
+            if path is not None or mask & IN_Q_OVERFLOW:
+                events.append((path, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+"""
+PurgeDaemon(purger,rescan_interval,max_queued): Runs the purge of purger continuously. purge_mode has to be 'execute'
+run(stop): Runs until stop (a threading.Event) is set, SIGTERM or SIGINT. The log goes to the log file of the purger
+"""
+class PurgeDaemon(object):
+    def __init__(self,purger,rescan_interval=86400,max_queued=1000000):
+        self.purger = purger
+        self.rescan_interval = rescan_interval
+        self.max_queued = max_queued
+        self.inotify = None
+        self.queue = []
+        self.queued = {}
+        self.order = itertools.count()
+        self.sections = {}
+        self.dir_depths = {}
+        self.tracking = False
+        self.overflow = False
+
+    def run(self,stop=None):
+        stop = stop or threading.Event()
+        handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                handlers[signum] = signal.signal(signum, lambda signum, frame: stop.set())
+        try:
+            with self.purger.applied(), self.purger.logged():
+                if engine.purge_mode != 'execute':
+                    raise ValueError('The purge daemon only runs with purge_mode = execute, not %s' % engine.purge_mode)
+                with engine.hold_run_state():
+                    self.loop(stop)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        return 0
+
+    """
+    loop(stop): Full purge, then events and expiries until stop is set. A full purge is run again every rescan_interval seconds and
+                as soon as the events can no longer be trusted (overflow). The wait for events is capped at one second so stop is
+                seen quickly
+    """
+    def loop(self,stop):
+        next_rescan = 0
+        try:
+            while not stop.is_set():
+                if self.overflow or time.time() >= next_rescan:
+                    self.rescan()
+                    next_rescan = time.time()+self.rescan_interval
+                timeout = min(1.0, next_rescan-time.time())
+                if self.queue:
+                    timeout = min(timeout, self.queue[0][0]-time.time())
+                if self.tracking:
+                    for path, mask, name in self.inotify.read(timeout):
+                        self.handle_event(path, mask, name)
+                else:
+                    stop.wait(max(0, timeout))
+                self.expire(time.time())
+        finally:
+            self.stop_tracking()
+            engine.wait_background_removals()
+        engine.logger.info('Purge daemon stopped')
+
+    """
+    rescan(): Full purge with engine.run_purge(), then the watches and the expiry queue are built again from one walk of the
+              sections and the dirs_to_del_list trees. Background deletes still running are waited for first, so their space
+              goes to the metrics they were started in
+    """
+    def rescan(self):
+        if self.overflow:
+            engine.logger.warning('Purge daemon : events were lost. Running a full rescan')
+        self.stop_tracking()
+        self.overflow = False
+        if engine.wait_background_removals():
+            engine.flush_metrics()
+        engine.run_purge()
+        config = engine.load_config()
+        if config is None:
+            engine.logger.error('Purge daemon : no usable configuration, only full rescans every %s s are run', self.rescan_interval)
+            return
+        engine.set_rules(config['rules'])
+        self.inotify = Inotify()
+        self.tracking = True
+        for section_config in config['sections']:
+            if section_config.problem is None and os.path.isdir(section_config.section):
+                self.watch_section(section_config)
+        for root in dirs_to_watch():
+            self.watch_tree(root,0)
+        if self.tracking:
+            engine.logger.info('Purge daemon : watching %s directories, %s item(s) queued%s', len(self.inotify.watches), len(self.queued), ', next expiry at %s' % time.ctime(self.queue[0][0]) if self.queue else '')
+
+    def stop_tracking(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+        del self.queue[:]
+        self.queued.clear()
+        self.sections.clear()
+        self.dir_depths.clear()
+        self.tracking = False
+
+    """
+    fall_back(reason): The expiry queue cannot be kept (watch limit, queue size). Nothing is tracked until the next rescan
+    """
+    def fall_back(self,reason):
+        engine.logger.warning('Purge daemon : %s. Falling back to a full rescan every %s s', reason, self.rescan_interval)
+        self.stop_tracking()
+
+    def watch(self,path):
+        if not self.tracking:
+            return False
+        try:
+            self.inotify.add_watch(path)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                self.fall_back('inotify watch limit reached (fs.inotify.max_user_watches)')
+            elif e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                engine.logger.warning('Unable to watch %s : %s', path, str(e))
+            return False
+        return True
+
+    """
+    watch_section(section_config): Watches a config section and queues its files
+    """
+    def watch_section(self,section_config):
+        path = os.path.normpath(section_config.path)
+        if not self.watch(path):
+            return
+        self.sections[path] = section_config
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    self.queue_file(section_config, entry.name)
+        except OSError as e:
+            engine.logger.warning('Unable to list %s : %s', path, str(e))
+
+    """
+    watch_tree(root,depth): Watches root and every directory below it probed by del_dirs() and queues the ones a dir rule selects
+    """
+    def watch_tree(self,root,depth):
+        for path, root_entry, path_depth, dirs, no_of_files in engine.walk_dirs(root,engine.dir_skip_patterns,engine.dir_max_depth,None,depth):
+            if not self.watch(path):
+                if not self.tracking:
+                    return
+                dirs[:] = []
+                continue
+            self.dir_depths[path] = path_depth
+            if path_depth > 0:
+                self.queue_dir(path)
+            dirs[:] = [entry for entry in dirs if not entry.name.startswith(engine.trash_prefix)]
+
+    """
+    push(expires,path,mtime,item): Queues path until expires. A path is queued once per mtime; an entry whose mtime is no longer the
+                                   queued one is skipped when it comes out of the queue
+    """
+    def push(self,expires,path,mtime,item):
+        if not self.tracking or self.queued.get(path) == mtime:
+            return
+        self.queued[path] = mtime
+        heapq.heappush(self.queue, (expires, next(self.order), path, mtime, item))
+        if len(self.queue) > self.max_queued:
+            self.fall_back('more than %s items queued' % self.max_queued)
+
+    """
+    queue_file(section_config,name): Queues a file of a section by the time its file rule expires it (a second after min_age, the
+                                     purge deletes what is strictly older). Excluded names, names no file
+                                     rule matches and anything that is not a regular file are never queued
+    """
+    def queue_file(self,section_config,name):
+        if engine.is_excluded(section_config.matcher, name):
+            return
+        rule = engine.match_rule(engine.purge_rules['file'], name, 1)
+        if rule is None:
+            return
+        path = section_config.path+name
+        try:
+            file_stat = os.lstat(path)
+        except OSError:
+            return
+        if stat.S_ISREG(file_stat.st_mode):
+            self.push(file_stat.st_mtime+rule.limit+1, path, file_stat.st_mtime, ('file', section_config, rule))
+
+    """
+    queue_dir(path): Queues a directory by the time the dir rule matching its name expires it
+    """
+    def queue_dir(self,path):
+        rule = engine.match_rule(engine.purge_rules['dir'], os.path.basename(path), self.dir_depths[path])
+        if rule is None:
+            return
+        try:
+            dir_stat = os.lstat(path)
+        except OSError:
+            return
+        self.push(dir_stat.st_mtime+rule.limit+1, path, dir_stat.st_mtime, ('dir', rule))
+
+    """
+    handle_event(path,mask,name): One inotify event on the watched directory path. A change inside a directory changes its mtime, so
+                                  the directory is queued again; a changed file of a section is queued again; a new directory below a
+                                  dirs_to_del_list root is walked and watched
+    """
+    def handle_event(self,path,mask,name):
+        if mask & IN_Q_OVERFLOW:
+            self.overflow = True
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+            self.forget(path)
+            return
+        child = os.path.join(path, name)
+        if path in self.sections and not mask & IN_ISDIR and mask & (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE):
+            self.queue_file(self.sections[path], name)
+        if path in self.dir_depths:
+            if self.dir_depths[path] > 0:
+                self.queue_dir(path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and not name.startswith(engine.trash_prefix):
+                depth = self.dir_depths[path]+1
+                if not engine.skip_subtree(name, depth, engine.dir_skip_patterns, engine.dir_max_depth):
+                    self.watch_tree(child, depth)
+
+    def forget(self,path):
+        self.sections.pop(path, None)
+        self.dir_depths.pop(path, None)
+        if self.inotify is not None:
+            self.inotify.remove_watch(path)
+
+    """
+    expire(now): Deletes the queued items expired by now. Each one is lstat-ed again first: gone means nothing to do, a new mtime
+                 means it is queued again for its new expiry. The background deletes (rmtree_background) that have finished are
+                 logged and accounted, and the metrics are written after a batch that deleted anything, so they are not lost when
+                 the next rescan resets them
+    """
+    def expire(self,now):
+        deleted = False
+        while self.queue and self.queue[0][0] <= now:
+            expires, order, path, mtime, item = heapq.heappop(self.queue)
+            if self.queued.get(path) != mtime:
+                continue
+            del self.queued[path]
+            try:
+                path_stat = os.lstat(path)
+            except OSError:
+                continue
+            if path_stat.st_mtime != mtime:
+                self.push(path_stat.st_mtime+item[-1].limit+1, path, path_stat.st_mtime, item)
+            elif item[0] == 'file':
+                deleted = delete_file(path, path_stat, item[1], item[2], now) or deleted
+            else:
+                deleted = self.delete_dir(path, path_stat, item[1], now) or deleted
+        if engine.collect_background_removals() or deleted:
+            engine.flush_metrics()
+
+    def delete_dir(self,path,dir_stat,rule,now):
+        listing = engine.list_dir(path)
+        if listing is None:
+            return False
+        dirs, no_of_files = listing
+        if not engine.del_dir_by_rule(path, rule, len(dirs), no_of_files, now-dir_stat.st_mtime, dir_stat):
+            return False
+        if self.inotify is not None:
+            for watched in [watched for watched in self.inotify.watches if watched == path or engine.is_below(watched, path)]:
+                self.forget(watched)
+        return True
+
+"""
+dirs_to_watch(): dirs_to_del_list without duplicates and without roots inside another root
+return: list of normalized roots
+"""
+def dirs_to_watch():
+    roots = []
+    for root in map(os.path.normpath, engine.dirs_to_del_list):
+        if root not in roots:
+            roots.append(root)
+    return [root for root in roots if not any(engine.is_below(root, other) for other in roots)]
+
+"""
+delete_file(path,file_stat,section_config,rule,now): Deletes one expired file of a section the way the file purge pipeline does:
+                                                     throttled, logged, audited and counted in the section, rule and run metrics
+                                                     (see engine.record_section_metrics())
+return: True if the file was deleted
+"""
+def delete_file(path,file_stat,section_config,rule,now):
+    section = section_config.path
+    try:
+        engine.throttled(os.remove, path, file_stat.st_size)
+    except OSError as e:
+        engine.logger.error("An error occured when processing delete_files operation: %s", str(e))
+        engine.add_metric('sections', section, errors=1)
+        engine.add_metric('counters', None, errors=1)
+        return False
+    engine.logger.info('Deleted file %s', path)
+    engine.audit('deleted', path, size=file_stat.st_size, age_hrs=round((now-file_stat.st_mtime)/3600), rule=rule.name)
+    engine.add_metric('sections', section, deleted=1)
+    engine.add_metric('rules', rule.name, deleted=1)
+    engine.account_reclaimed(section, rule.name, file_stat.st_size, 1)
+    engine.add_metric('counters', None, files_deleted=1, file_bytes_freed=file_stat.st_size)
+    return True
@@ -0,0 +1,2515 @@
+#!/usr/bin/python
+####################################################################################################################################
+# Description:                                                                                                                     #
+#               Purge engine of the ops_purge package. The settings are the globals of the Variable Declaration block, set for     #
+#               each run by ops_purge.Purger; run it with "python -m ops_purge" (or purging_files.py)                              #
+#               In each dir defined in files_to_exclude.config, exlcude the list of files or file patterns                         #
+#               And delete the rest if unmodifeid in last 48 hours                                                                 #
+#               Directory deletion logic for /adbadmin                                                                             #
+#               1. Any directory with a name starting with 3 or 4 and unmodified in > 365 days is deleted                          #
+#               2. All other directories with a name starting with other digits and unmodified in > 30 days are deleted            #
+# Test Cases:                                                                                                                      #
+#               1. Program wont proceed if files_to_exclude.config doesn't exist under base_path                                   #
+#               2. file_path_correction() adds a "/" incase base_path or section defined in                                        #
+#                  config file doesnt have "/" as the last character                                                               #
+#               3. If no files satisfy DELETE condition, the same is logged in app.log                                             #
+#               4. If any file is DELETED, the same is logged in app.log                                                           #
+#               5. If the file to be deleted is a directory, it wont be deleted and same is logged in app.log                      #
+#               6. After each operation, files in current directory that is each section in the config file are printed in app.log #
+#               7. If no values are provided for any section thats is directory path, same will be logged.                         #
+#                  Without this check it would delete all files under that directory                                               #
+#               8. If files's age is < 48 hours, they wont be deleted                                                              #
+#               9. Exception conditions for config file parsing including:                                                         #
+#                  a. Config file is empty                                                                                         #
+#                  b. Section = Directory in config file doesnt exist                                                              #
+#                  c. Incorrect key in section. Expected key is "Files"                                                            #
+#                  d. Empty list of "files"                                                                                        #
+# Modification History:                                                                                                            #
+#               rrsolomo: added all utility functions                                                                              #
+#               rrsolomo: added time checks to permit files created < 48 hours to exist                                            #
+#               rrsolomo: added config file exception conditions to avoid human errors                                             #
+#               rrsolomo: cosmetic changes to logging data                                                                         #
+#               rrsolomo: Files modified < 48 hours ago will be retained even when not prsent in exclude list                      #
+#               rrsolomo: Added wildcard parsing functionality to exclude files like "tf*.env"                                     #
+#               rrsolomo: Added functionality to delete directories older than an year with name starting with digits in /adbadmin #
+#               rrsolomo: Enahnced functionality to delete dirs under /adbadmin based on dir name and age                          #
+#               Rebuilt section scan on os.scandir, one cached stat per entry and per-section stat counter                         #
+#               del_dirs() walks with a pruning scandir walker, deleted/skipped subtrees are not descended                         #
+#               Concurrent mode (purge_workers) for sections and top-level subtrees with grouped logs                              #
+#               Exclude lists compiled once into one matcher (literals + combined regex), **, classes, !negation                   #
+#               purge_mode plan/apply: write a JSON lines purge plan, apply it later with mtime re-checks                          #
+#               incremental_index: SQLite index of dir mtimes/listings/child ages, unchanged dirs not re-listed                    #
+#               log_mode summary (counts, sizes, capped samples) and optional queued JSON lines audit stream                       #
+#               remove_tree(): threaded recursive delete with throughput/error report, optional background delete                  #
+#               Ages computed against one run_started clock with precomputed per-rule limits and batch_ages()                      #
+#               Purge run moved into main() so the module can be imported by purge_benchmark.py                                    #
+#               File purge rebuilt as a pluggable generator pipeline (scan, exclude, age check, delete)                            #
+#               async_mode: stat/unlink issued from asyncio tasks with a per-mount concurrency limit, for NFS mounts               #
+#               disk_pressure: below the statvfs free space/inode targets younger items are deleted oldest-first                   #
+#               Rule table (ops_files_purge_rules.cfg), one compiled regex per type, replaces dir_digits/48h/365d/30d              #
+#               Validated config compiled once into ops_files_purge.cfgcache (keyed by mtime+sha256), --check-config               #
+#               Moved into the ops_purge package: Purger class (settings as parameters, dict results) and CLI                      #
+#               Run metrics: phase/section/rule/mount timers and counters, Prometheus textfile or JSON (metrics_path)              #
+#               Reclaimed bytes/inodes per rule, section and dirs root from the stat data of the deletes                           #
+#               Delete throttling: token buckets for ops/s and bytes/s with adaptive unlink latency backoff                        #
+#               Merged traversal: sections below a dirs_to_del_list root are purged by the del_dirs() walk                         #
+#               Continuous purge daemon driven by inotify (ops_purge/daemon.py), built on run_purge() and the rules                #
+#               Sharding across hosts by stable hash with O_CREAT|O_EXCL lease files (shard_count)                                 #
+####################################################################################################################################
+
+import configparser
+import json
+import os
+import logging
+import datetime
+import fnmatch
+import re
+import stat
+import collections
+import threading
+import contextvars
+import asyncio
+import heapq
+import concurrent.futures
+import sqlite3
+import queue
+import itertools
+import logging.handlers
+import time
+import hashlib
+import socket
+import contextlib
+
+"""
+Variable Declaration
+"""
+sample_config = '''
+\t\t\t\t  An example entry in config file would look like \n \t\t\t\t  [DIRECTORY_PATH] \n \t\t\t\t  files = ["1.txt","2.txt"]
+'''
+seperator1 = "-"*100
+delim = "\n\t\t\t\t\t > "
+
+base_path = '/adbadmin/rrsolomo/'
+log_file_path = '/adbadmin/rrsolomo/ops_files_purge.log'
+dirs_to_del_list = ["/adbadmin/rrsolomo"]
+dir_skip_patterns = []      # directory names (fnmatch patterns) whose whole subtree is neither probed nor deleted by del_dirs()
+dir_max_depth = None        # deepest level below a dirs_to_del_list root probed by del_dirs(). None means no limit
+purge_workers = 1           # >1 purges config sections and top-level subtrees of dirs_to_del_list concurrently
+purge_mode = 'execute'      # 'execute' deletes as before, 'plan' only writes purge_plan_file, 'apply' deletes what a saved plan lists
+incremental_index = False   # True keeps directory mtimes/listings/child ages in purge_index_file and skips re-listing unchanged dirs
+full_rescan = False         # True ignores (and rebuilds) the incremental index for this run
+log_mode = 'full'           # 'full' logs every file and whole directory listings, 'summary' logs counts, sizes and a capped sample of names
+log_sample_size = 20        # number of names shown per list when log_mode = 'summary'
+audit_log_path = None       # when set, one JSON record per file/directory decision is written to this file (JSON lines)
+rmtree_threads = 1          # threads used by remove_tree() to delete one expired directory tree
+rmtree_background = False   # True renames an expired directory out of the way and deletes it in the background
+age_batch_size = 1000       # entries stat-ed and aged together by the expired_entries() stage of the file purge pipeline
+async_mode = False          # True issues the stat/unlink calls from asyncio tasks, many in flight at once (NFS and other high latency mounts)
+async_concurrency_per_mount = 32   # blocking calls in flight per mount point in async_mode
+disk_pressure = False       # True deletes younger files/directories oldest-first while a mount is below free_space_target/free_inodes_target
+free_space_target = 0.10    # fraction of the blocks of a mount that has to be free when disk_pressure is on
+free_inodes_target = 0.05   # fraction of the inodes of a mount that has to be free when disk_pressure is on
+pressure_min_age = {'pressure_files': 6*3600, 'pressure_dirs': 7*86400}   # seconds; nothing younger is deleted under disk pressure
+metrics_path = None         # when set, the run metrics (phase/section/rule/mount timers and counters) are written to this file
+metrics_format = 'prometheus'   # 'prometheus' (node_exporter textfile collector, e.g. ops_files_purge.prom) or 'json'
+throttle_ops_per_sec = None     # when set, at most this many unlink/rmdir calls per second over the whole run (all threads)
+throttle_bytes_per_sec = None   # when set, at most this many bytes freed per second by those calls
+throttle_latency_target = None  # seconds; when set, the ops rate is halved while the unlink latency is above it (needs throttle_ops_per_sec)
+shard_count = None          # when set, hosts sharing the trees split the sections and top-level subtrees into this many shards (lease files)
+shard_lease_seconds = 3600  # a claimed shard is not purged again until its lease is this old; keep it below the interval between runs
+
+"""
+file_path_correction(): Adds a "/" at the end of directory paths. This is to avoid human error while creating the config file
+return: file_path
+"""
+def file_path_correction(file_path):
+    if file_path[-1] != "/":
+        file_path = file_path+"/"
+    return file_path
+
+base_path = file_path_correction(base_path)
+config_file = base_path+"ops_files_purge_exceptions.cfg"
+purge_plan_file = base_path+"ops_files_purge.plan"
+purge_index_file = base_path+"ops_files_purge.index"
+rules_file = base_path+"ops_files_purge_rules.cfg"
+config_cache_file = base_path+"ops_files_purge.cfgcache"
+shard_lease_dir = base_path+"ops_files_purge.shards"
+
+"""
+logger: Logger of the purge. Only this logger (and its handlers and filter) is touched, never the root logger of the host process
+"""
+logger = logging.getLogger('ops_purge')
+
+"""
+buffered_log_filter(record): Filter of logger used in concurrent mode. While a worker thread (or, in async_mode, a section
+                             task) runs a section or subtree, its log records are held in the log_buffer context variable and
+                             written out together by run_concurrently() so the log for one section is not interleaved with the others
+return: False when the record was buffered
+"""
+log_buffer = contextvars.ContextVar('log_buffer', default=None)
+def buffered_log_filter(record):
+    records = log_buffer.get()
+    if records is None:
+        return True
+    records.append(record)
+    return False
+
+logger.addFilter(buffered_log_filter)
+
+"""
+start_audit_log(path): Starts the optional JSON lines audit stream. Records go through a QueueHandler so the purge threads only
+                       enqueue them, the JSON encoding and file writes happen on the QueueListener thread
+stop_audit_log(): Drains and stops the stream and takes its QueueHandler off audit_logger, so a long-lived process does not keep
+                  queueing records for the streams of earlier runs
+audit(action,path,**fields): Queues one audit record. Does nothing unless start_audit_log() was called
+"""
+class AuditQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self,record):
+        return record
+
+class AuditFormatter(logging.Formatter):
+    def format(self,record):
+        return json.dumps(dict(record.msg, ts=round(record.created,3)), separators=(',',':'))
+
+audit_logger = logging.getLogger('ops_files_purge.audit')
+audit_logger.propagate = False
+audit_listener = None
+audit_handler = None
+def start_audit_log(path):
+    global audit_listener, audit_handler
+    stop_audit_log()
+    audit_queue = queue.Queue()
+    file_handler = logging.FileHandler(path)
+    file_handler.setFormatter(AuditFormatter())
+    audit_listener = logging.handlers.QueueListener(audit_queue,file_handler)
+    audit_handler = AuditQueueHandler(audit_queue)
+    audit_logger.addHandler(audit_handler)
+    audit_logger.setLevel(logging.INFO)
+    audit_listener.start()
+
+def stop_audit_log():
+    global audit_listener, audit_handler
+    if audit_handler is not None:
+        audit_logger.removeHandler(audit_handler)
+        audit_handler = None
+    if audit_listener is not None:
+        audit_listener.stop()
+        for handler in audit_listener.handlers:
+            handler.close()
+        audit_listener = None
+
+def audit(action,path,**fields):
+    if audit_listener is not None:
+        fields.update(action=action, path=path)
+        audit_logger.info(fields)
+
+"""
+Run metrics: timers and counters of one run, returned by run_purge() and written to metrics_path in metrics_format
+    phases   : seconds per phase of the run (config_load, files, dirs, disk_pressure, total) and of the file pipeline (scan, match,
+               age_check, delete; summed over sections, measured when metrics_path is set)
+    sections : per section seconds, entries, excluded, kept_recent, not_files, deleted, errors and, for sections and
+               dirs_to_del_list roots, freed_bytes and freed_inodes (see account_reclaimed())
+    rules    : per rule files/directories deleted and kept, seconds spent deleting directories, freed_bytes and freed_inodes
+    mounts   : per mount point seconds spent in its sections
+    counters : run totals (dirs_probed, dir_errors, dir_bytes_freed, errors ...)
+add_metric(group,key,**values): Adds values to the counters of key in group ('counters' takes no key, pass None)
+timed(group,key): Context manager adding the seconds spent in the block to key in group
+"""
+metrics_lock = threading.Lock()
+run_metrics = {}
+metric_groups = [('phases','phase'), ('sections','section'), ('rules','rule'), ('mounts','mount')]
+def reset_metrics():
+    with metrics_lock:
+        run_metrics.clear()
+        run_metrics.update((group, {}) for group,label in metric_groups)
+        run_metrics['counters'] = collections.Counter()
+
+def add_metric(group,key,**values):
+    with metrics_lock:
+        if group == 'counters':
+            run_metrics['counters'].update(values)
+        else:
+            run_metrics[group].setdefault(key, collections.Counter()).update(values)
+
+@contextlib.contextmanager
+def timed(group,key):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_metric(group,key,seconds=time.perf_counter()-started)
+
+reset_metrics()
+
+"""
+account_reclaimed(section,rule,freed_bytes,freed_inodes): Adds space reclaimed (or, in plan mode, to be reclaimed) to the section
+                                                          (a config section or a dirs_to_del_list root, None for neither), the
+                                                          rule and the run totals. The numbers come from the stat data the
+                                                          deletes already have, nothing is walked again to count them
+owning_root(path): The dirs_to_del_list root holding path, None if there is none
+"""
+def account_reclaimed(section,rule,freed_bytes,freed_inodes):
+    if section is not None:
+        add_metric('sections',section,freed_bytes=freed_bytes,freed_inodes=freed_inodes)
+    if rule is not None:
+        add_metric('rules',rule,freed_bytes=freed_bytes,freed_inodes=freed_inodes)
+    add_metric('counters',None,freed_bytes=freed_bytes,freed_inodes=freed_inodes)
+
+def owning_root(path):
+    roots = [file_path_correction(root) for root in dirs_to_del_list if path.startswith(file_path_correction(root))]
+    return max(roots,key=len) if roots else None
+
+"""
+log_reclaimed(): Logs the space reclaimed by the run, in total and per rule
+"""
+def log_reclaimed():
+    verb = 'Planned to reclaim' if purge_mode == 'plan' else 'Reclaimed'
+    with metrics_lock:
+        totals = run_metrics['counters']
+        rules = [(rule, values['freed_bytes'], values['freed_inodes']) for rule,values in sorted(run_metrics['rules'].items()) if values['freed_inodes'] > 0]
+        logger.info('%s : %s byte(s) in %s inode(s)', verb, totals['freed_bytes'], totals['freed_inodes'])
+    for rule,freed_bytes,freed_inodes in rules:
+        logger.info('%s by rule %s : %s byte(s) in %s inode(s)', verb, rule, freed_bytes, freed_inodes)
+
+"""
+metrics_snapshot(): Plain dict copy of run_metrics (JSON serializable)
+"""
+def metrics_snapshot():
+    with metrics_lock:
+        snapshot = dict((group, dict((key, dict(values)) for key,values in run_metrics[group].items())) for group,label in metric_groups)
+        snapshot['counters'] = dict(run_metrics['counters'])
+    snapshot['run_started'] = run_started
+    return snapshot
+
+def prometheus_label(value):
+    return str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+"""
+prometheus_metrics(snapshot): Prometheus text exposition of a metrics_snapshot(): ops_purge_<label>_<field>{<label>="<key>"} for the
+                              keyed groups and ops_purge_<field> for the run counters, all gauges of the last run
+return: text
+"""
+def prometheus_metrics(snapshot):
+    lines = []
+    def gauge(name,samples):
+        lines.append('# TYPE %s gauge' % name)
+        lines.extend('%s%s %s' % (name, labels, repr(float(value)) if isinstance(value,float) else value) for labels,value in samples)
+    for group,label in metric_groups:
+        fields = sorted(set(field for values in snapshot[group].values() for field in values))
+        for field in fields:
+            gauge('ops_purge_%s_%s' % (label,field), [('{%s="%s"}' % (label,prometheus_label(key)), values[field]) for key,values in sorted(snapshot[group].items()) if field in values])
+    for field,value in sorted(snapshot['counters'].items()):
+        gauge('ops_purge_%s' % field, [('',value)])
+    gauge('ops_purge_last_run_timestamp_seconds', [('',snapshot['run_started'])])
+    return '\n'.join(lines)+'\n'
+
+"""
+write_metrics(path,format): Writes the metrics of the run to path, through a temporary file renamed into place so a collector
+                            never reads a half written file
+flush_metrics(): write_metrics() to metrics_path when it is set; a failure is logged
+"""
+def write_metrics(path,format):
+    snapshot = metrics_snapshot()
+    with open(path+'.tmp','w') as metrics_file:
+        if format == 'json':
+            json.dump(snapshot,metrics_file,indent=1,sort_keys=True)
+        else:
+            metrics_file.write(prometheus_metrics(snapshot))
+    os.replace(path+'.tmp',path)
+
+def flush_metrics():
+    if metrics_path is not None:
+        try:
+            write_metrics(metrics_path,metrics_format)
+        except OSError as e:
+            logger.error("Unable to write the metrics %s: %s", metrics_path, str(e))
+
+"""
+log_phase_timings(): One log line with the seconds of every phase of the run
+"""
+def log_phase_timings():
+    with metrics_lock:
+        phases = [(phase, values['seconds']) for phase,values in run_metrics['phases'].items()]
+    logger.info('Phase timings : %s', ', '.join('%s %.3f s' % (phase,seconds) for phase,seconds in phases))
+
+"""
+name_sample(names): Caps a list of names for log_mode = 'summary'
+return: at most log_sample_size names joined with delim, followed by "..." when there were more
+"""
+def name_sample(names):
+    names = list(itertools.islice(names,log_sample_size+1))
+    sample = delim.join(map(str,names[:log_sample_size]))
+    if len(names) > log_sample_size:
+        sample += delim+'...'
+    return sample
+
+"""
+log_section_listing(context): Logs what is left in a section after the purge. In summary mode the count and a sample are taken
+                              from the pipeline counters instead of listing the directory again
+"""
+def log_section_listing(context):
+    section = context['section']
+    logger.info('%s',seperator1)
+    if log_mode == 'summary':
+        remaining = context['entries'] - (context['deleted'] if purge_mode != 'plan' else 0)
+        logger.info('Current files/directories in directory : %s : %s entrie(s), e.g.: \n\t\t\t\t\t > %s', section, remaining, name_sample(context['kept_sample']))
+    else:
+        # logger.info('Current files/directories in directory : %s are \n\t\t\t\t %s', section,  [str(file) for file in os.listdir(section)])
+        logger.info('Current files/directories in directory : %s are: \n\t\t\t\t\t > %s', section,  delim.join(list(map(str,os.listdir(section)))))
+    logger.info('%s',seperator1)
+
+"""
+header_footer(): For cosmetic purpose. Adds line separator in the log file for better readability
+return: nothing
+"""
+def header_footer(state):
+    seperator = "="*100
+    if state == "begin":
+        logger.info('%s',seperator)
+        logger.info('Log for operations performed on %s', datetime.datetime.now())
+        logger.info('%s',seperator)
+    else:
+        logger.info('%s',seperator)
+        logger.info('End of operations performed on %s', datetime.datetime.now())
+        logger.info('%s',seperator)
+
+"""
+run_started: Reference clock of the run. Every age is computed against this one epoch timestamp, so two paths checked seconds
+             apart are judged against the same "now"
+age_limits: Per rule age limits in whole seconds, filled from the rule table by load_rules(). A path is old enough when its age is
+            strictly greater than the limit. The extra half unit matches the rounding the day/hour comparisons have always used
+            (round(age in hours) > 48 etc.)
+"""
+run_started = time.time()
+age_limits = {
+    'files_48h': 48*3600 + 1800,
+    'dirs_3_4_365d': 365*86400 + 43200,
+    'dirs_not_3_4_30d': 30*86400 + 43200,
+}
+
+"""
+Rule table: which files of a section and which directories under dirs_to_del_list are deleted, and at which age. Rules are read
+from ops_files_purge_rules.cfg next to ops_files_purge_exceptions.cfg, one section per rule, in order:
+    [dirs_3_4_365d]
+    type = dir                (file: entries of a config section, dir: directories probed by del_dirs())
+    pattern = [34]*           (fnmatch style, ** and !negation are not used here)
+    min_age = 365d            (s, m, h or d)
+    max_depth = 3             (optional; depth below the dirs_to_del_list root, files of a section are at depth 1)
+The first rule matching a name wins; a name no rule matches is never deleted (directories are still probed further). Without the
+file the built-in default_rules below apply, which are the historical 48 hours / 3-4 prefixed 365 days / other digits 30 days
+"""
+default_rules = [
+    ('files_48h', 'file', '*', '48h', None),
+    ('dirs_3_4_365d', 'dir', '[34]*', '365d', None),
+    ('dirs_not_3_4_30d', 'dir', '[0-9]*', '30d', None),
+]
+age_units = {'s': (1, 'second(s)'), 'm': (60, 'minutes'), 'h': (3600, 'hours'), 'd': (86400, 'days')}
+Rule = collections.namedtuple('Rule', 'name type pattern min_age max_depth limit label regex')
+RuleTable = collections.namedtuple('RuleTable', 'rules regex')
+purge_rules = {}
+
+"""
+make_rule(name,type,pattern,min_age,max_depth): Validates one rule and computes its age limit (see age_limits) and log label
+return: Rule
+"""
+def make_rule(name,type,pattern,min_age,max_depth):
+    if type not in ('file','dir'):
+        raise ValueError('rule %s: type must be "file" or "dir", found "%s"' % (name,type))
+    match = re.fullmatch(r'\s*(\d+)\s*([smhd]?)\s*', min_age)
+    if match is None:
+        raise ValueError('rule %s: invalid min_age "%s", expected e.g. 48h or 365d' % (name,min_age))
+    value, unit = int(match.group(1)), match.group(2) or 's'
+    seconds, unit_name = age_units[unit]
+    return Rule(name, type, pattern, '%s%s' % (value,unit), max_depth, value*seconds + seconds//2, '%s %s' % (value,unit_name),
+                re.compile(glob_to_regex(pattern,hidden=True), re.DOTALL))
+
+"""
+compile_rules(rules): Compiles the rules of each type into one regex of named alternatives, (?P<r0>...)|(?P<r1>...)|..., so a name is
+                      checked against every rule in a single match; the group that matched is the first rule matching the name
+return: dict type -> RuleTable
+"""
+def compile_rules(rules):
+    tables = {}
+    for type in ('file','dir'):
+        typed = [rule for rule in rules if rule.type == type]
+        regex = re.compile('|'.join('(?P<r%d>%s)' % (i,rule.regex.pattern) for i,rule in enumerate(typed)), re.DOTALL) if typed else None
+        tables[type] = RuleTable(typed, regex)
+    return tables
+
+"""
+load_rules(path): Reads the rule table from path, or takes default_rules when the file does not exist
+return: dict type -> RuleTable, or None when the file is invalid (logged)
+"""
+def load_rules(path):
+    try:
+        if os.path.exists(path):
+            parser = configparser.ConfigParser()
+            parser.read(path)
+            rules = [make_rule(name, parser.get(name,'type').strip(), parser.get(name,'pattern').strip(), parser.get(name,'min_age'),
+                               parser.getint(name,'max_depth') if parser.get(name,'max_depth',fallback='').strip() else None)
+                     for name in parser.sections()]
+            logger.info('Using %s rule(s) from %s', len(rules), path)
+        else:
+            rules = [make_rule(*rule) for rule in default_rules]
+    except (ValueError, configparser.Error) as e:
+        logger.error("An error occured when loading the rules %s: %s", path, str(e))
+        return None
+    return compile_rules(rules)
+
+"""
+set_rules(tables): Makes a compiled rule table the one of this run and adds its limits to age_limits, so plans made with it can be
+                   re-checked by apply_plan()
+"""
+def set_rules(tables):
+    purge_rules.update(tables)
+    age_limits.update((rule.name, rule.limit) for table in tables.values() for rule in table.rules)
+
+"""
+match_rule(table,name,depth): First rule of a RuleTable matching name at depth
+return: Rule or None
+"""
+def match_rule(table,name,depth):
+    match = table.regex.fullmatch(name) if table.regex is not None else None
+    if match is None:
+        return None
+    for rule in table.rules[int(match.lastgroup[1:]):]:
+        if (rule.max_depth is None or depth <= rule.max_depth) and rule.regex.fullmatch(name):
+            return rule
+    return None
+
+"""
+modification_days_minutes_calculator(): Utility function to compute the modified tim eof a dir and compute the difference in days/hrs/mins with current time
+                                        When mtime is passed (taken from an already cached stat) the path is not stat-ed again
+                                        The current time is run_started
+return : diff_days,diff_hrs,diff_mins
+"""
+def modification_days_minutes_calculator(root,mtime=None):
+    modification_time = os.path.getmtime(root) if mtime is None else mtime
+    age = run_started - modification_time
+    diff_days  = round(age / (60 * 60 * 24))
+    diff_hrs  = round(age / (60 * 60))
+    diff_mins =  round(age / (60))
+    return diff_days,diff_hrs,diff_mins
+
+"""
+batch_ages(stat_results,now): Ages in seconds of a list of stat results in one pass, against run_started unless now is given
+return: list of ages (None where the stat result is None)
+"""
+def batch_ages(stat_results,now=None):
+    now = run_started if now is None else now
+    return [now - file_stat.st_mtime if file_stat is not None else None for file_stat in stat_results]
+
+"""
+config_file_check(): Parse ops_files_purge_exceptions.cfg file
+return: config
+"""
+def config_file_check():
+    try:
+        if os.path.exists(config_file):
+            config = configparser.ConfigParser()
+            config.read(config_file)
+            return config
+        else:
+            logger.error('File ops_files_purge_exceptions.cfg doesnt exist in %s', base_path)
+    except (ValueError, configparser.MissingSectionHeaderError, configparser.DuplicateSectionError, configparser.DuplicateOptionError,configparser.ParsingError) as e:
+        logger.error("An error occured when loading ops_files_purge_exceptions.cfg: %s",str(e))
+        logger.error("Try adding atleast one directory path. %s", sample_config)
+"""
+Compiled configuration: ops_files_purge_exceptions.cfg and ops_files_purge_rules.cfg are parsed, validated and compiled (exclude
+matchers, rule regexes) once and saved as JSON in config_cache_file, keyed by the mtime and sha256 of both files. Runs load that
+artifact and only fall back to parsing when either file changed. Sections with errors are kept in the artifact with their problem,
+which is logged each run as before. JSON rather than pickle: the artifact holds regex sources and lists only, never code
+"""
+config_cache_version = 1
+SectionConfig = collections.namedtuple('SectionConfig', 'section path files_to_exclude matcher problem')
+
+"""
+file_key(path): mtime and sha256 of a file
+return: [mtime, hex digest], or None when the file does not exist
+"""
+def file_key(path):
+    try:
+        with open(path,'rb') as config:
+            return [os.fstat(config.fileno()).st_mtime, hashlib.sha256(config.read()).hexdigest()]
+    except FileNotFoundError:
+        return None
+
+"""
+check_section(config,section): Validates one section of ops_files_purge_exceptions.cfg and compiles its exclude list. Nothing is
+                               read from the section directory
+return: SectionConfig, with problem ('key', found key) or ('parse', error) when the section is not usable
+"""
+def check_section(config,section):
+    try:
+        key = list(config[section].keys())[0]
+        if key != 'files':
+            return SectionConfig(section, None, None, None, ('key', key))
+        files_to_exclude = [str(file) for file in json.loads(config.get(section, 'files'))]
+        return SectionConfig(section, file_path_correction(section), files_to_exclude, compile_exclusions(files_to_exclude), None)
+    except Exception as e:
+        return SectionConfig(section, None, None, None, ('parse', str(e)))
+
+def regex_source(regex):
+    return regex.pattern if regex is not None else None
+
+def compiled_regex(source):
+    return re.compile(source, re.DOTALL) if source is not None else None
+
+"""
+config_to_json(compiled), config_from_json(data): Converts the compiled configuration (sections and rule tables) to and from the
+                                                  JSON form of the artifact
+"""
+def config_to_json(compiled):
+    sections = []
+    for section in compiled['sections']:
+        matcher = section.matcher
+        if matcher is not None:
+            matcher = [sorted(matcher.literals), regex_source(matcher.pattern), sorted(matcher.negated_literals), regex_source(matcher.negated_pattern)]
+        sections.append([section.section, section.path, section.files_to_exclude, matcher, section.problem])
+    rules = [list(rule[:-1])+[rule.regex.pattern] for table in compiled['rules'].values() for rule in table.rules]
+    return {'sections': sections, 'rules': rules}
+
+def config_from_json(data):
+    sections = []
+    for section,path,files_to_exclude,matcher,problem in data['sections']:
+        if matcher is not None:
+            matcher = ExclusionMatcher(frozenset(matcher[0]), compiled_regex(matcher[1]), frozenset(matcher[2]), compiled_regex(matcher[3]))
+        sections.append(SectionConfig(section, path, files_to_exclude, matcher, tuple(problem) if problem is not None else None))
+    rules = [Rule(*(rule[:-1]+[compiled_regex(rule[-1])])) for rule in data['rules']]
+    return {'sections': sections, 'rules': compile_rules(rules)}
+
+"""
+compile_config(): Parses and validates both configuration files
+return: dict with sections (list of SectionConfig) and rules (see load_rules()), or None when a file cannot be used (logged)
+"""
+def compile_config():
+    config = config_file_check()
+    if config is None:
+        return None
+    rules = load_rules(rules_file)
+    if rules is None:
+        return None
+    return {'sections': [check_section(config,section) for section in config.sections()], 'rules': rules}
+
+"""
+load_config(): Compiled configuration of this run, from config_cache_file when it was made from the current files, otherwise
+               compiled again and saved for the next runs
+return: see compile_config()
+"""
+def load_config():
+    key = [config_cache_version, file_key(config_file), file_key(rules_file)]
+    try:
+        with open(config_cache_file) as cache:
+            data = json.load(cache)
+        if data['key'] == key:
+            compiled = config_from_json(data)
+            logger.info('Using the compiled configuration %s', config_cache_file)
+            return compiled
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning('Unable to use the compiled configuration %s, compiling it again: %s', config_cache_file, str(e))
+    compiled = compile_config()
+    if compiled is not None and key[1] is not None:
+        save_config(compiled,key)
+    return compiled
+
+def save_config(compiled,key):
+    data = dict(config_to_json(compiled), key=key)
+    try:
+        with open(config_cache_file+'.tmp','w') as cache:
+            json.dump(data,cache)
+        os.replace(config_cache_file+'.tmp',config_cache_file)
+    except OSError as e:
+        logger.warning('Unable to save the compiled configuration %s: %s', config_cache_file, str(e))
+
+"""
+check_config(): --check-config. Validates every section of ops_files_purge_exceptions.cfg and the rule table up front, without
+                reading the section directories or the dirs_to_del_list trees (only their existence is checked), and saves the
+                compiled configuration when there are no errors. Messages go to logger (stderr with the CLI)
+return: exit status, 0 when the configuration has no errors
+"""
+def check_config():
+    compiled = compile_config()
+    if compiled is None:
+        return 1
+    errors = 0
+    for section in compiled['sections']:
+        if section.problem is not None:
+            log_section_problem(section)
+            errors += 1
+        else:
+            logger.info('[%s] %s exclude entrie(s)', section.section, len(section.files_to_exclude))
+            if not os.path.isdir(section.section):
+                logger.warning('Directory path %s mentioned in ops_files_purge_exceptions.cfg doesnt exist', section.section)
+    if len(compiled['sections']) == 0:
+        logger.warning('File ops_files_purge_exceptions.cfg is empty')
+    for type,table in sorted(compiled['rules'].items()):
+        for rule in table.rules:
+            logger.info('Rule %s : %s %s older than %s%s', rule.name, type, rule.pattern, rule.label, '' if rule.max_depth is None else ', max depth %s' % rule.max_depth)
+    for src_dir in dirs_to_del_list:
+        if not os.path.isdir(src_dir):
+            logger.warning('Directory %s of dirs_to_del_list doesnt exist', src_dir)
+    logger.info('%s section(s), %s with errors', len(compiled['sections']), errors)
+    if errors == 0:
+        save_config(compiled,[config_cache_version, file_key(config_file), file_key(rules_file)])
+    return 1 if errors else 0
+
+"""
+scan_entries(context): Source stage of the file purge pipeline. Yields the entries of the section from a single os.scandir pass,
+                       one at a time, so nothing grows with the size of the directory. Nothing is stat-ed here. With the
+                       incremental index the entries come from scan_section_indexed() instead. When the del_dirs() walk purges
+                       the section, the entries are also added to its listing, which is complete once the scan is drained
+"""
+def scan_entries(context):
+    section = context['section']
+    if purge_index is not None:
+        context['scanned'],context['section_mtime'],context['listed_at'] = scan_section_indexed(section,context['stat_counter'])
+        entries = iter(context['scanned'].values())
+        for entry in entries:
+            context['entries'] += 1
+            yield entry
+        return
+    listing = context.get('listing')
+    with os.scandir(section) as entries:
+        for entry in entries:
+            context['entries'] += 1
+            if listing is not None:
+                add_to_listing(listing,entry)
+            yield entry
+    if listing is not None:
+        listing['complete'] = True
+
+"""
+entry_stat(entry,stat_counter): Stat a DirEntry (or IndexedEntry) once, the result is cached on the entry. Calls that reach the
+                                filesystem are counted in stat_counter
+return: os.stat_result or None if the entry vanished or is a dangling symlink
+"""
+def entry_stat(entry,stat_counter):
+    if getattr(entry,'cached',None) is None:
+        stat_counter['stat'] += 1
+    try:
+        return entry.stat()
+    except OSError:
+        return None
+
+"""
+open_index(index_file): Opens (creating it if needed) the SQLite incremental index. Table sections keeps, per config section, the
+                        directory mtime and the mode/mtime/size of every entry. Table walk keeps, per directory probed by del_dirs(),
+                        the directory mtime, its file count and its sub-directory names. Both keep listed_at, the time the listing
+                        was read (an index made before that column is upgraded in place, its rows are re-listed once)
+return: sqlite3 connection
+"""
+purge_index = None
+purge_index_lock = threading.Lock()
+index_racy_seconds = 2.0    # a listing read less than this after the directory mtime is not trusted (see index_current())
+def open_index(index_file):
+    index = sqlite3.connect(index_file,check_same_thread=False)
+    index.execute('CREATE TABLE IF NOT EXISTS sections (path TEXT PRIMARY KEY, mtime REAL, entry_count INTEGER, entries TEXT, listed_at REAL)')
+    index.execute('CREATE TABLE IF NOT EXISTS walk (path TEXT PRIMARY KEY, mtime REAL, files INTEGER, subdirs TEXT, listed_at REAL)')
+    for table in ('sections','walk'):
+        if 'listed_at' not in [column[1] for column in index.execute('PRAGMA table_info(%s)' % table)]:
+            index.execute('ALTER TABLE %s ADD COLUMN listed_at REAL' % table)
+    return index
+
+"""
+index_get(table,path): Row of path in table: mtime, listed_at, then entries (sections) or files, subdirs (walk)
+return: row, or None when path is not indexed or full_rescan is set
+index_current(row,mtime): True if the listing of row can be used for a directory whose mtime is now mtime. The mtime has to be
+                          the recorded one and the listing read at least index_racy_seconds after it: on a filesystem keeping
+                          mtimes to the second (NFSv3, ext3), an entry created in the second of the recorded mtime, after the
+                          listing, leaves the mtime unchanged. Such a "racy" row is re-listed, as git does for racy index entries
+"""
+def index_get(table,path):
+    with purge_index_lock:
+        row = purge_index.execute('SELECT mtime, listed_at, %s FROM %s WHERE path = ?' % ('entries' if table == 'sections' else 'files, subdirs', table), (path,)).fetchone()
+    if row is None or full_rescan:
+        return None
+    return row
+
+def index_current(row,mtime):
+    return row is not None and row[0] == mtime and row[1] is not None and row[1]-mtime >= index_racy_seconds
+
+def index_put_section(path,mtime,entries,listed_at):
+    cached = {entry.name: entry.cached for entry in entries}
+    with purge_index_lock:
+        purge_index.execute('REPLACE INTO sections (path, mtime, entry_count, entries, listed_at) VALUES (?,?,?,?,?)', (path,mtime,len(cached),json.dumps(cached,separators=(',',':')),listed_at))
+
+def index_put_walk(path,mtime,no_of_files,dirs,listed_at):
+    subdirs = [[entry.name, entry.is_symlink()] for entry in dirs]
+    with purge_index_lock:
+        purge_index.execute('REPLACE INTO walk (path, mtime, files, subdirs, listed_at) VALUES (?,?,?,?,?)', (path,mtime,no_of_files,json.dumps(subdirs,separators=(',',':')),listed_at))
+
+"""
+index_forget(root): Drops a deleted directory and everything below it from the walk table
+"""
+def index_forget(root):
+    if purge_index is None:
+        return
+    with purge_index_lock:
+        purge_index.execute('DELETE FROM walk WHERE path = ? OR substr(path,1,?) = ?', (root,len(root)+1,root+'/'))
+
+def close_index():
+    global purge_index
+    if purge_index is not None:
+        with purge_index_lock:
+            purge_index.commit()
+            purge_index.close()
+        purge_index = None
+
+"""
+IndexedEntry: Stands in for os.DirEntry when entries come from the incremental index. cached holds [st_mode, st_mtime, st_size]
+              as recorded on an earlier run (None when never stat-ed). from_index marks ages that have not been confirmed in this
+              run, such entries are stat-ed again by refresh_entry() before anything is deleted
+"""
+IndexedStat = collections.namedtuple('IndexedStat', 'st_mode st_mtime st_size')
+class IndexedEntry(object):
+    def __init__(self,directory,name,cached=None,symlink=False):
+        self.name = name
+        self.path = os.path.join(directory,name)
+        self.cached = IndexedStat(*cached) if cached is not None else None
+        self.from_index = cached is not None
+        self.symlink = symlink
+
+    def stat(self,follow_symlinks=True):
+        if self.cached is None:
+            entry_st = os.stat(self.path) if follow_symlinks else os.lstat(self.path)
+            self.cached = IndexedStat(entry_st.st_mode,entry_st.st_mtime,entry_st.st_size)
+        return self.cached
+
+    def is_dir(self):
+        return True
+
+    def is_symlink(self):
+        return self.symlink
+
+"""
+refresh_entry(entry,stat_counter): Replaces the indexed stat of an entry by a fresh one
+return: fresh IndexedStat or None if the entry is gone
+"""
+def refresh_entry(entry,stat_counter):
+    entry.cached, entry.from_index = None, False
+    return entry_stat(entry,stat_counter)
+
+"""
+scan_section_indexed(section,stat_counter): Incremental variant of scan_entries(). The section directory is stat-ed first and, when
+                                            its mtime matches the index (see index_current()), the cached listing is reused without
+                                            reading the directory or stat-ing any entry. Otherwise the directory is listed and only
+                                            names not yet in the index are left to be stat-ed
+return: dict of entry name -> IndexedEntry, section mtime, time the listing was read
+"""
+def scan_section_indexed(section,stat_counter):
+    stat_counter['stat'] += 1
+    section_mtime = os.stat(section).st_mtime
+    row = index_get('sections',section)
+    cached = json.loads(row[2]) if row is not None else {}
+    if index_current(row,section_mtime):
+        return {name: IndexedEntry(section,name,values) for name,values in cached.items()},section_mtime,row[1]
+    listed_at = time.time()
+    with os.scandir(section) as entries:
+        return {entry.name: IndexedEntry(section,entry.name,cached.get(entry.name)) for entry in entries},section_mtime,listed_at
+
+"""
+update_section_index(section,scanned,section_mtime,listed_at,deleted,stat_counter): Saves the listing of a section after it was
+                    purged. When files were deleted the directory mtime has moved, so it is stat-ed again before being re-listed
+                    and new names are recorded unstat-ed. Stat-ing before listing means a later change shows up as a new mtime next
+                    run, unless it falls in the same mtime second (see index_current())
+"""
+def update_section_index(section,scanned,section_mtime,listed_at,deleted,stat_counter):
+    if deleted != 0:
+        stat_counter['stat'] += 1
+        section_mtime = os.stat(section).st_mtime
+        listed_at = time.time()
+        with os.scandir(section) as entries:
+            scanned = {entry.name: scanned.get(entry.name) or IndexedEntry(section,entry.name) for entry in entries}
+    index_put_section(section,section_mtime,scanned.values(),listed_at)
+
+"""
+glob_to_regex(pattern): Translates one exclude pattern to a regular expression. Supports "*", "?", character classes like
+                        "[0-9]" / "[!a-z]" and "**". Like glob, "*", "?" and classes do not match a leading "." unless the
+                        pattern itself starts with "."
+return: regex string
+"""
+def glob_to_regex(pattern,hidden=False):
+    regex = []
+    i, n = 0, len(pattern)
+    while i < n:
+        char = pattern[i]
+        if char == '*':
+            if pattern[i:i+2] == '**':
+                regex.append('.*')
+                i += 2
+                continue
+            regex.append('[^/]*')
+        elif char == '?':
+            regex.append('[^/]')
+        elif char == '[':
+            j = i+1
+            if j < n and pattern[j] in '!^':
+                j += 1
+            if j < n and pattern[j] == ']':
+                j += 1
+            while j < n and pattern[j] != ']':
+                j += 1
+            if j >= n:
+                regex.append('\\[')
+            else:
+                chars = pattern[i+1:j].replace('\\','\\\\').replace('[','\\[')
+                if chars[0] in '!^':
+                    chars = '^'+chars[1:]
+                regex.append('['+chars+']')
+                i = j+1
+                continue
+        else:
+            regex.append(re.escape(char))
+        i += 1
+    if not pattern.startswith('.') and not hidden:
+        regex.insert(0,'(?!\\.)')
+    return ''.join(regex)
+
+"""
+compile_exclusions(files_to_exclude): Compiles the exclude list of a section once. Literal names go to a frozenset and all wildcard
+                                      patterns are combined into a single regex. Entries starting with "!" are negations: a name
+                                      matching a negation is not excluded even if it matches another entry. Every entry is also
+                                      kept as a literal so names like "report[1].txt" still match themselves
+return: ExclusionMatcher
+"""
+ExclusionMatcher = collections.namedtuple('ExclusionMatcher', 'literals pattern negated_literals negated_pattern')
+def compile_exclusions(files_to_exclude):
+    literals, patterns, negated_literals, negated_patterns = set(), [], set(), []
+    for file in files_to_exclude:
+        if file.startswith('!'):
+            file, names, regexes = file[1:], negated_literals, negated_patterns
+        else:
+            names, regexes = literals, patterns
+        names.add(file)
+        if any(char in file for char in '*?['):
+            regexes.append(glob_to_regex(file))
+    def combine(regexes):
+        return re.compile('|'.join('(?:%s)' % regex for regex in regexes), re.DOTALL) if regexes else None
+    return ExclusionMatcher(frozenset(literals), combine(patterns), frozenset(negated_literals), combine(negated_patterns))
+
+"""
+is_excluded(matcher,name): Tests one directory entry name against a compiled ExclusionMatcher
+return: True if the entry must be kept
+"""
+def is_excluded(matcher,name):
+    if name in matcher.literals or (matcher.pattern is not None and matcher.pattern.fullmatch(name)):
+        if name in matcher.negated_literals or (matcher.negated_pattern is not None and matcher.negated_pattern.fullmatch(name)):
+            return False
+        return True
+    return False
+
+"""
+section_context(section_config): Turns one checked section of the compiled configuration into the pipeline context of the section
+return: pipeline context (see new_file_context()) or None when the section is not usable (the reason is logged)
+"""
+def section_context(section_config):
+    section = section_config.section
+    if not os.path.isdir(section):
+        logger.warning('Directory path %s mentioned in ops_files_purge_exceptions.cfg doesnt exist', section)
+        return None
+    if section_config.problem is not None:
+        log_section_problem(section_config)
+        return None
+    if len(section_config.files_to_exclude) == 0:
+        logger.warning('No files included in the exclude list for directory %s. \n\t\t\t\t\t Any files not modified in the last 48 hours in this directory will be deleted.', section_config.path)
+    return new_file_context(section_config.path,section_config.matcher)
+
+def log_section_problem(section_config):
+    kind,detail = section_config.problem
+    if kind == 'key':
+        logger.error('Invalid key found for directory path: %s in ops_files_purge_exceptions.cfg. Expected "files" found "%s"', section_config.section, detail)
+        logger.error("Correct the key. %s", sample_config)
+    else:
+        log_section_error(section_config.section,detail)
+
+def log_section_error(section,e):
+    logger.error("An error occured when parsing the ops_files_purge_exceptions.cfg: %s",str(e))
+    logger.error("Check the values defined for %s.", section)
+    logger.error("Check the configuration details. %s", sample_config)
+
+"""
+finish_section(context,result): End of a section once its pipeline has run: summary, incremental index update, listing
+return: result updated with the number of deleted files and bytes and the number of stat calls
+"""
+def finish_section(context,result):
+    section = context['section']
+    if context['candidates'] == 0:
+        logger.info('No files to delete in %s', section)
+    else:
+        log_file_purge(context)
+    if purge_index is not None:
+        update_section_index(section,context['scanned'],context['section_mtime'],context['listed_at'],context['deleted'] if purge_mode == 'execute' else 0,context['stat_counter'])
+    log_section_listing(context)
+    result.update(deleted=context['deleted'], deleted_bytes=context['deleted_bytes'], stat_calls=context['stat_counter']['stat'])
+    return result
+
+"""
+purge_section(section_config,listing): Apply the exclude list of one section of ops_files_purge_exceptions.cfg and delete the rest
+                                       with the file purge pipeline (see run_file_pipeline()). With a listing (see
+                                       purge_walk_section()) scan_entries() also fills it with the sub-directories and the file
+                                       count of the section
+return: dict with the section, the number of deleted files and bytes and the number of stat calls
+"""
+def purge_section(section_config,listing=None):
+    section = section_config.section
+    result = {'section': section, 'deleted': 0, 'deleted_bytes': 0, 'stat_calls': 0}
+    logger.info('PROCESSING :  %s', section)
+    started = time.perf_counter()
+    context = section_context(section_config)
+    if context is not None:
+        context['listing'] = listing
+        try:
+            run_file_pipeline(context)
+            finish_section(context,result)
+        except Exception as e:
+            log_section_error(section,e)
+        record_section_metrics(context,time.perf_counter()-started)
+    return result
+
+"""
+run_grouped(func,*args): Runs func in a worker thread with its log records buffered (see buffered_log_filter())
+return: result of func (None if it raised) and the buffered log records
+"""
+def run_grouped(func,*args):
+    records = []
+    log_buffer.set(records)
+    result = None
+    try:
+        result = func(*args)
+    except Exception as e:
+        logger.error("An error occured when processing %s%s: %s", func.__name__, args[-1:], str(e))
+    finally:
+        log_buffer.set(None)
+    return result,records
+
+"""
+run_concurrently(tasks,workers): Runs each (func,args) task on a bounded thread pool. The log records of every task are written
+                                 out as one block, in task order, as soon as the task and all tasks before it have finished
+return: list of task results in task order
+"""
+def run_concurrently(tasks,workers):
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_grouped,func,*args) for func,args in tasks]
+        for future in futures:
+            result,records = future.result()
+            for record in records:
+                logger.handle(record)
+            results.append(result)
+    return results
+
+"""
+file_differences(): For each directory path mentioned in ops_files_purge_exceptions.cfg , identify the difference between current files/dirs and
+                                        the exclude list. Pass this difference list to delete_files().
+                                        With purge_workers > 1 the sections are purged concurrently, one section per worker.
+                                        sections limits the run to those sections (see plan_traversal())
+return: list of per-section results from purge_section()
+"""
+def file_differences(config,sections=None):
+    results = []
+    try:
+        if len(config['sections']) !=0:
+            sections = config['sections'] if sections is None else sections
+            if purge_workers > 1:
+                results = run_concurrently([(purge_section,(section,)) for section in sections],purge_workers)
+            else:
+                for section in sections:
+                    results.append(purge_section(section))
+        else:
+            logger.warning('File ops_files_purge_exceptions.cfg is empty')
+    except Exception as e:
+        logger.error("An error occured when processing file_differences function: %s",str(e))
+    return [result for result in results if result is not None]
+
+"""
+File purge pipeline: scan_entries() -> exclude_entries() -> expired_entries() -> delete_files()
+Every stage is a generator taking the stream of the previous stage and the per-section context, so entries flow through one at a
+time (expired_entries() holds at most age_batch_size of them) and memory does not grow with the size of the directory. The stages
+after scan_entries() are listed in file_purge_stages and can be replaced or extended, e.g. to add a filter or a throttle
+"""
+
+"""
+new_file_context(section,matcher): Per-section state shared by the pipeline stages: counters, phase timers, capped name samples and,
+                                   with log_mode = 'full' only, the list of deleted files for the end-of-section listing
+return: context dict
+"""
+def new_file_context(section,matcher):
+    return {'section': section, 'matcher': matcher, 'stat_counter': collections.Counter(),
+            'entries': 0, 'candidates': 0, 'deleted': 0, 'deleted_bytes': 0, 'kept_recent': 0, 'not_files': 0,
+            'deleted_files': [], 'deleted_sample': [], 'kept_sample': [], 'scanned': None, 'section_mtime': None, 'listed_at': None,
+            'errors': 0, 'timers': {}, 'rule_deleted': collections.Counter(), 'rule_bytes': collections.Counter()}
+
+def keep_entry(context,name):
+    if len(context['kept_sample']) < log_sample_size:
+        context['kept_sample'].append(name)
+
+"""
+exclude_entries(entries,context): Drops the entries matching the compiled exclude list of the section
+"""
+def exclude_entries(entries,context):
+    matcher = context['matcher']
+    for entry in entries:
+        if is_excluded(matcher,entry.name):
+            keep_entry(context,entry.name)
+            continue
+        context['candidates'] += 1
+        yield entry
+
+"""
+expired_entries(entries,context): Stats the candidates once each, in batches of age_batch_size aged with batch_ages(), and yields
+                                  (entry, stat, age, rule) for the regular files older than the min_age of the first file rule
+                                  matching their name. Entries aged from the incremental index are confirmed with a fresh stat
+                                  before being passed on
+"""
+def expired_entries(entries,context):
+    section, stat_counter, full_log = context['section'], context['stat_counter'], log_mode != 'summary'
+    file_rules = purge_rules['file']
+    while True:
+        batch = list(itertools.islice(entries,age_batch_size))
+        if len(batch) == 0:
+            return
+        file_stats = [entry_stat(entry,stat_counter) for entry in batch]
+        for entry,file_stat,age in zip(batch,file_stats,batch_ages(file_stats)):
+            file = entry.name
+            rule = match_rule(file_rules,file,1)
+            if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
+                context['not_files'] += 1
+                keep_entry(context,file)
+                if full_log:
+                    logger.info('%s is a directory. Hence not deleted', section+file)
+                audit('kept',section+file,reason='not_a_file')
+            elif rule is None:
+                context['kept_recent'] += 1
+                keep_entry(context,file)
+                if full_log:
+                    logger.info('No rule matches file %s. Hence its not being deleted', section+file)
+                audit('kept',section+file,reason='no_rule')
+            elif age <= rule.limit:
+                keep_under_pressure(section+file,'pressure_files',age,file_stat)
+                context['kept_recent'] += 1
+                keep_entry(context,file)
+                if full_log:
+                    logger.info('File %s was modified in the last %s. Hence its not being deleted', section+file, rule.label)
+                audit('kept',section+file,reason='modified_%s' % rule.min_age,age_hrs=round(age/3600))
+            elif getattr(entry,'from_index',False) and not file_still_expired(entry,rule,stat_counter):
+                context['kept_recent'] += 1
+                keep_entry(context,file)
+                logger.info('File %s was modified since it was indexed. Hence its not being deleted', section+file)
+                audit('kept',section+file,reason='modified_since_indexed')
+            else:
+                yield entry,file_stat,age,rule
+
+"""
+delete_files(expired,context): Last stage. Removes (or, in plan mode, plans) every expired file it receives
+                               Yields the path of each deleted file
+"""
+def delete_files(expired,context):
+    section = context['section']
+    for entry,file_stat,age,rule in expired:
+        if purge_mode != 'plan':
+            try:
+                throttled(os.remove,section+entry.name,file_stat.st_size)
+            except OSError as e:
+                logger.error("An error occured when processing delete_files operation: %s",str(e))
+                context['errors'] += 1
+                continue
+        yield file_deleted(context,entry,file_stat,age,rule)
+
+"""
+file_deleted(context,entry,file_stat,age,rule): Logs, audits and counts one file removed by the purge (or added to the plan in plan mode)
+return: path of the file
+"""
+def file_deleted(context,entry,file_stat,age,rule):
+    path, full_log = context['section']+entry.name, log_mode != 'summary'
+    diff_hrs = round(age/3600)
+    if purge_mode == 'plan':
+        add_plan_entry(path,'file',file_stat.st_size,file_stat.st_mtime,rule.name)
+        if full_log:
+            logger.info('Planned deletion of file %s', path)
+        audit('planned',path,size=file_stat.st_size,age_hrs=diff_hrs,rule=rule.name)
+    else:
+        if full_log:
+            logger.info('Deleted file %s', path)
+        audit('deleted',path,size=file_stat.st_size,age_hrs=diff_hrs,rule=rule.name)
+    context['deleted'] += 1
+    context['deleted_bytes'] += file_stat.st_size
+    context['rule_deleted'][rule.name] += 1
+    context['rule_bytes'][rule.name] += file_stat.st_size
+    if full_log:
+        context['deleted_files'].append(path)
+    elif len(context['deleted_sample']) < log_sample_size+1:
+        context['deleted_sample'].append(path)
+    return path
+
+file_purge_stages = [exclude_entries, expired_entries, delete_files]
+
+"""
+run_file_pipeline(context): Chains scan_entries() and file_purge_stages for one section and drains the result. When metrics are
+                            written every stage is wrapped by timed_stream(), which times the pulls from the stage; as a pull
+                            includes the stages before it, the time of each phase is the difference with the previous wrapper
+return: context
+"""
+stage_phases = {'exclude_entries': 'match', 'expired_entries': 'age_check', 'delete_files': 'delete'}
+def run_file_pipeline(context):
+    profile = metrics_path is not None
+    stream = scan_entries(context)
+    phases = ['scan']
+    if profile:
+        stream = timed_stream(stream,context,'scan')
+    for stage in file_purge_stages:
+        stream = stage(stream,context)
+        if profile:
+            phases.append(stage_phases.get(stage.__name__,stage.__name__))
+            stream = timed_stream(stream,context,phases[-1])
+    try:
+        for deleted in stream:
+            pass
+    except Exception as e:
+        logger.error("An error occured when processing delete_files operation: %s",str(e))
+        context['errors'] += 1
+    if profile:
+        timers, upstream = context['timers'], 0.0
+        for phase in phases:
+            timers[phase], upstream = timers.get(phase,0.0)-upstream, timers.get(phase,0.0)
+    return context
+
+def timed_stream(stream,context,phase):
+    timers = context['timers']
+    timers[phase] = 0.0
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(stream)
+        except StopIteration:
+            timers[phase] += time.perf_counter()-started
+            return
+        timers[phase] += time.perf_counter()-started
+        yield item
+
+"""
+record_section_metrics(context,seconds): Adds the counters and timers of a finished section to run_metrics
+"""
+def record_section_metrics(context,seconds):
+    section = context['section']
+    add_metric('sections',section,seconds=seconds,entries=context['entries'],excluded=context['entries']-context['candidates'],
+               kept_recent=context['kept_recent'],not_files=context['not_files'],deleted=context['deleted'],errors=context['errors'])
+    for phase,phase_seconds in context['timers'].items():
+        add_metric('phases',phase,seconds=phase_seconds)
+    for rule,deleted in context['rule_deleted'].items():
+        add_metric('rules',rule,deleted=deleted)
+        account_reclaimed(section,rule,context['rule_bytes'][rule],deleted)
+    try:
+        add_metric('mounts',mount_point(section),seconds=seconds)
+    except OSError:
+        pass
+    add_metric('counters',None,files_deleted=context['deleted'],file_bytes_freed=context['deleted_bytes'],errors=context['errors'])
+
+"""
+log_file_purge(context): End-of-section summary of the file purge pipeline
+"""
+def log_file_purge(context):
+    section = context['section']
+    if log_mode == 'summary':
+        logger.info('%s : %s file(s) %s (%s byte(s)), %s file(s) too young or matching no rule kept, %s non-file entrie(s) kept', section, context['deleted'], 'planned for deletion' if purge_mode == 'plan' else 'deleted', context['deleted_bytes'], context['kept_recent'], context['not_files'])
+        if context['deleted'] != 0:
+            logger.info('Sample of %s files: \n\t\t\t\t\t > %s', 'planned' if purge_mode == 'plan' else 'deleted', name_sample(context['deleted_sample']))
+    elif context['deleted'] != 0 and purge_mode == 'plan':
+        logger.info('The following files would be deleted by the purge plan: \n\t\t\t\t\t > %s',  delim.join(list(map(str,context['deleted_files']))))
+    elif context['deleted'] != 0:
+        # logger.info('The following files were deleted in this execution: %s', [str(file) for file in deleted_files])
+        logger.info('The following files were deleted in this execution: \n\t\t\t\t\t > %s',  delim.join(list(map(str,context['deleted_files']))))
+    logger.info('Stat calls for %s : %s for %s candidate(s)', section, context['stat_counter']['stat'], context['candidates'])
+
+"""
+file_still_expired(entry,rule,stat_counter): Confirms with a fresh stat that an entry aged from the incremental index is still a
+                                             regular file older than the min_age of its rule
+return: True if it can be deleted
+"""
+def file_still_expired(entry,rule,stat_counter):
+    file_stat = refresh_entry(entry,stat_counter)
+    if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
+        return False
+    return run_started - file_stat.st_mtime > rule.limit
+
+"""
+dir_del_banner(del_or_nodel_flag,root,no_of_dirs,no_of_files,age_to_print)
+Banner message in the log when dir is either deleted or not deleted based on age specification. Kept directories are not logged
+when log_mode = 'summary'
+"""
+def dir_del_banner(del_or_nodel_flag,root,no_of_dirs,no_of_files,age_to_print):
+    if del_or_nodel_flag == "del":
+        logger.info('PROCESSING : %s',root)
+        logger.info('%s : has %s directori(es) and %s file(s)', root,no_of_dirs,no_of_files)
+        logger.info('%s is  older than %s. Hence proceeding with deletion of the directory', root,age_to_print) 
+    elif log_mode != 'summary':
+        logger.info('PROCESSING : %s',root)
+        logger.info('%s : has %s directori(es) and %s file(s)', root,no_of_dirs,no_of_files)
+        logger.info('%s is not older than %s. Sub-directories will be probed further.',root,age_to_print)
+        logger.info('%s',seperator1) 
+"""
+del_dir_by_rule(root,rule,no_of_dirs,no_of_files,age,dir_stat): Utility function called from del_dirs(). Deletes root when it is older
+                                                                 than the min_age of the dir rule its name matched. age is in
+                                                                 seconds, measured against run_started
+return: True if the directory was deleted (or planned for deletion)
+"""
+def del_dir_by_rule(root,rule,no_of_dirs,no_of_files,age,dir_stat=None):
+    if age > rule.limit:
+        dir_del_banner("del",root,no_of_dirs,no_of_files,age_to_print=rule.label)
+        with timed('rules',rule.name):
+            remove_expired_dir(root,rule.name,dir_stat)
+        add_metric('rules',rule.name,deleted=1)
+        logger.info('%s',seperator1)
+        return True
+    else:
+        add_metric('rules',rule.name,kept=1)
+        dir_del_banner("nodel",root,no_of_dirs,no_of_files,age_to_print=rule.label)
+        keep_under_pressure(root,'pressure_dirs',age,dir_stat)
+        audit('kept',root,reason='younger_than_%s' % rule.min_age,age_days=round(age/86400),rule=rule.name)
+        return False
+
+"""
+Throttle(ops_per_sec,bytes_per_sec,latency_target): Token buckets for the deletes of the run, shared by all threads. Each bucket
+                                                    holds one second of its rate; a delete takes one op token and the size of what
+                                                    it frees in byte tokens, and when it takes the bucket below zero the caller
+                                                    sleeps until the tokens are paid back, so concurrent callers queue up
+acquire(size): Waits until a delete freeing size bytes may run
+observe(latency): Adaptive mode (latency_target). The latency of every delete feeds a moving average; at most once per second the
+                  ops rate is halved while the average is above latency_target (down to a twentieth of
+                  throttle_ops_per_sec, so the purge still progresses) and raised again by a tenth of it while it is below
+"""
+class Throttle(object):
+    def __init__(self,ops_per_sec=None,bytes_per_sec=None,latency_target=None):
+        self.lock = threading.Lock()
+        self.max_ops_rate, self.ops_rate, self.bytes_rate = ops_per_sec, ops_per_sec, bytes_per_sec
+        self.ops_tokens, self.bytes_tokens = ops_per_sec or 0, bytes_per_sec or 0
+        self.latency_target, self.latency = latency_target, 0.0
+        self.refilled = self.adjusted = time.monotonic()
+
+    def acquire(self,size=0):
+        with self.lock:
+            now = time.monotonic()
+            elapsed, self.refilled = now-self.refilled, now
+            wait = 0.0
+            if self.ops_rate:
+                self.ops_tokens = min(self.ops_rate, self.ops_tokens+elapsed*self.ops_rate)-1
+                wait = max(wait, -self.ops_tokens/self.ops_rate)
+            if self.bytes_rate:
+                self.bytes_tokens = min(self.bytes_rate, self.bytes_tokens+elapsed*self.bytes_rate)-size
+                wait = max(wait, -self.bytes_tokens/self.bytes_rate)
+        if wait > 0:
+            add_metric('counters',None,throttle_seconds=wait)
+            time.sleep(wait)
+
+    def observe(self,latency):
+        if self.latency_target is None:
+            return
+        with self.lock:
+            self.latency = 0.8*self.latency+0.2*latency
+            now = time.monotonic()
+            if now-self.adjusted < 1:
+                return
+            ops_rate = self.ops_rate
+            if self.latency > self.latency_target:
+                self.ops_rate = max(self.max_ops_rate/20.0, self.ops_rate/2)
+            else:
+                self.ops_rate = min(self.max_ops_rate, self.ops_rate+self.max_ops_rate/10.0)
+            self.adjusted = now
+        if self.ops_rate != ops_rate:
+            logger.info('Unlink latency %.1f ms (target %.1f ms) : deletes throttled to %.0f ops/s', self.latency*1000, self.latency_target*1000, self.ops_rate)
+
+"""
+start_throttle(): Sets purge_throttle for the run from the throttle_* settings (None when there is nothing to throttle)
+throttled(func,path,size): Runs the delete func(path) through purge_throttle
+"""
+purge_throttle = None
+def start_throttle():
+    global purge_throttle
+    purge_throttle = None
+    latency_target = throttle_latency_target
+    if latency_target is not None and throttle_ops_per_sec is None:
+        logger.warning('throttle_latency_target needs throttle_ops_per_sec as the rate to back off from. Adaptive throttling is off')
+        latency_target = None
+    if throttle_ops_per_sec is None and throttle_bytes_per_sec is None:
+        return
+    purge_throttle = Throttle(throttle_ops_per_sec,throttle_bytes_per_sec,latency_target)
+    logger.info('Deletes throttled to %s op(s)/s and %s byte(s)/s%s', throttle_ops_per_sec or 'unlimited', throttle_bytes_per_sec or 'unlimited', ', backing off above %.1f ms unlink latency' % (latency_target*1000) if latency_target is not None else '')
+
+def throttled(func,path,size=0):
+    throttle = purge_throttle
+    if throttle is None:
+        return func(path)
+    throttle.acquire(size)
+    started = time.perf_counter()
+    try:
+        return func(path)
+    finally:
+        throttle.observe(time.perf_counter()-started)
+
+"""
+remove_tree(root,threads,rule): Recursive delete of a directory tree used instead of shutil.rmtree(ignore_errors=True). Directories
+                                are work items on a pool of threads: a worker lists one directory, unlinks its files and queues
+                                its sub-directories; a directory is removed as soon as its last sub-directory is gone. Failures
+                                are collected per path instead of being ignored. The bytes are the sizes of the unlinked files
+                                and of the directories (root included), the same count as tree_usage() in plan mode
+return: dict with the rule, files, dirs, inodes (files and dirs removed), bytes freed, seconds and errors (list of path, error)
+"""
+def remove_tree(root,threads=1,rule=None):
+    report = {'path': root, 'rule': rule, 'files': 0, 'dirs': 0, 'bytes': 0, 'errors': []}
+    pending = {}
+    lock = threading.Lock()
+    finished = threading.Event()
+    started = time.time()
+
+    def remove_dir(path,parent):
+        try:
+            throttled(os.rmdir,path)
+            with lock:
+                report['dirs'] += 1
+        except OSError as e:
+            with lock:
+                report['errors'].append((path,str(e)))
+        if parent is None:
+            finished.set()
+            return
+        with lock:
+            pending[parent[0]] -= 1
+            parent_done = pending[parent[0]] == 0
+        if parent_done:
+            remove_dir(*parent)
+
+    def remove_contents(path,parent):
+        subdirs, files, freed, errors = [], 0, 0, []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                            freed += entry.stat(follow_symlinks=False).st_size
+                            continue
+                        size = entry.stat(follow_symlinks=False).st_size
+                        throttled(os.unlink,entry.path,size)
+                        files, freed = files+1, freed+size
+                    except OSError as e:
+                        errors.append((entry.path,str(e)))
+        except OSError as e:
+            errors.append((path,str(e)))
+        with lock:
+            report['files'] += files
+            report['bytes'] += freed
+            report['errors'].extend(errors)
+            pending[path] = len(subdirs)
+        if len(subdirs) == 0:
+            remove_dir(path,parent)
+        for subdir in subdirs:
+            executor.submit(remove_contents,subdir,(path,parent))
+
+    try:
+        report['bytes'] = os.lstat(root).st_size
+    except OSError:
+        pass
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1,threads)) as executor:
+        executor.submit(remove_contents,root,None)
+        finished.wait()
+    report['inodes'] = report['files']+report['dirs']
+    report['seconds'] = time.time()-started
+    return report
+
+"""
+log_remove_report(report): Logs the throughput and the errors of one remove_tree() call and accounts the space it reclaimed
+"""
+def log_remove_report(report):
+    add_metric('counters',None,dir_bytes_freed=report['bytes'],dir_files_removed=report['files'],dir_errors=len(report['errors']))
+    account_reclaimed(owning_root(report['path']),report['rule'],report['bytes'],report['inodes'])
+    seconds = max(report['seconds'],0.001)
+    logger.info('Removed %s : %s file(s) and %s dir(s), %s byte(s) freed in %.2f s (%.0f files/s)', report['path'], report['files'], report['dirs'], report['bytes'], report['seconds'], report['files']/seconds)
+    errors = report['errors'] if log_mode != 'summary' else report['errors'][:log_sample_size]
+    for path,error in errors:
+        logger.warning('Unable to remove %s : %s', path, error)
+    if len(errors) < len(report['errors']):
+        logger.warning('... and %s more error(s) removing %s', len(report['errors'])-len(errors), report['path'])
+
+"""
+remove_dir_tree(root,rule): Deletes an expired directory with remove_tree(). With rmtree_background the directory is first renamed
+                            to a hidden trash name in the same parent, so the path disappears at once, and the delete runs on a
+                            background thread; wait_background_removals() collects those reports at the end of the run. A
+                            leftover trash directory (rule trash_rule, see probe_dir()) is not renamed again
+return: report of remove_tree(), or None when the delete was handed to the background
+"""
+trash_prefix = '.purge-trash-'
+trash_rule = 'trash'
+background_removals = []
+background_trash = set()
+background_executor = None
+background_lock = threading.Lock()
+def remove_dir_tree(root,rule=None):
+    global background_executor
+    if not rmtree_background:
+        report = remove_tree(root,rmtree_threads,rule)
+        log_remove_report(report)
+        return report
+    parent,name = os.path.split(root.rstrip('/'))
+    trash = os.path.join(parent,'%s%s-%s-%s' % (trash_prefix,name,os.getpid(),int(time.time()*1000000)))
+    if name.startswith(trash_prefix):
+        trash = root
+    else:
+        try:
+            os.rename(root,trash)
+        except OSError as e:
+            logger.warning('Unable to move %s out of the way (%s). Deleting it in place', root, str(e))
+            trash = root
+    logger.info('%s moved to %s, deleting in the background', root, trash)
+    with background_lock:
+        background_trash.add(trash)
+        if background_executor is None:
+            background_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1,purge_workers))
+        background_removals.append(background_executor.submit(remove_tree,trash,rmtree_threads,rule))
+    return None
+
+"""
+wait_background_removals(): Waits for the directory deletes started with rmtree_background and logs their reports
+return: list of reports
+collect_background_removals(): Logs the reports of the background deletes that have finished, without waiting for the others. Used
+                               between runs by ops_purge.daemon so their space is accounted before the metrics are written
+return: list of reports
+"""
+def wait_background_removals():
+    global background_executor
+    reports = []
+    for future in background_removals:
+        report = future.result()
+        log_remove_report(report)
+        reports.append(report)
+    del background_removals[:]
+    background_trash.clear()
+    if background_executor is not None:
+        background_executor.shutdown()
+        background_executor = None
+    return reports
+
+def collect_background_removals():
+    done, pending = [], []
+    with background_lock:
+        for future in background_removals:
+            (done if future.done() else pending).append(future)
+        background_removals[:] = pending
+    reports = []
+    for future in done:
+        report = future.result()
+        log_remove_report(report)
+        background_trash.discard(report['path'])
+        reports.append(report)
+    return reports
+
+"""
+remove_expired_dir(root,rule,dir_stat): Removes a directory selected by rule. In plan mode the directory is only added to the plan
+                                        together with the recursive size of its tree (tree_usage() is the one extra walk, as
+                                        nothing below an expired directory is listed when it is not deleted)
+"""
+def remove_expired_dir(root,rule,dir_stat):
+    record_deleted_dir(root)
+    if purge_mode == 'plan':
+        if dir_stat is None:
+            dir_stat = os.lstat(root)
+        tree_bytes,tree_inodes = tree_usage(root)
+        tree_bytes,tree_inodes = tree_bytes+dir_stat.st_size,tree_inodes+1
+        add_plan_entry(root,'dir',tree_bytes,dir_stat.st_mtime,rule)
+        logger.info('Planned deletion of %s : %s byte(s) in %s inode(s)', root, tree_bytes, tree_inodes)
+        audit('planned',root,type='dir',size=tree_bytes,inodes=tree_inodes,rule=rule)
+        account_reclaimed(owning_root(root),rule,tree_bytes,tree_inodes)
+    else:
+        remove_dir_tree(root,rule)
+        index_forget(root)
+        audit('deleted',root,type='dir',rule=rule)
+
+"""
+skip_subtree(name,depth,skip_patterns,max_depth): Name/depth rule used by walk_dirs() to leave out a whole subtree
+return: True if the directory and everything below it must not be probed
+"""
+def skip_subtree(name,depth,skip_patterns,max_depth):
+    if max_depth is not None and depth > max_depth:
+        return True
+    return any(fnmatch.fnmatchcase(name,pattern) for pattern in skip_patterns)
+
+"""
+walk_dirs(src_dir,skip_patterns,max_depth): Top-down directory walk built on os.scandir, used by del_dirs() instead of os.walk
+Yields root,root_entry,depth,dirs,no_of_files where dirs is a list of os.DirEntry and root_entry is the DirEntry of root
+(None for src_dir itself, which is never stat-ed, unless root_entry/depth are passed to start the walk at a subtree). Like os.walk,
+the caller prunes by emptying dirs in place, so a deleted directory is not descended into. Symlinked directories are listed in
+dirs but not followed. With the incremental index every directory is stat-ed and its listing is taken from the index when its
+mtime has not changed. A directory that is a config section reached by the walk (see walk_sections), src_dir included, is listed
+by the purge of its files instead
+"""
+def walk_dirs(src_dir,skip_patterns=(),max_depth=None,root_entry=None,depth=0):
+    stack = [(src_dir,root_entry,depth)]
+    while stack:
+        root,root_entry,depth = stack.pop()
+        section_config = walk_sections.get(root)
+        listing = list_dir(root,root_entry) if section_config is None else purge_walk_section(root,root_entry,section_config)
+        if listing is None:
+            continue
+        dirs, no_of_files = listing
+        yield root,root_entry,depth,dirs,no_of_files
+        for entry in reversed(dirs):
+            if entry.is_symlink() or skip_subtree(entry.name,depth+1,skip_patterns,max_depth):
+                continue
+            stack.append((entry.path,entry,depth+1))
+
+"""
+list_dir(root,root_entry): One step of walk_dirs(): the sub-directories of root (os.DirEntry or IndexedEntry) and its file count,
+                           from a single os.scandir pass or, with the incremental index, from the index when the mtime of root
+                           has not changed and the indexed listing is not racy (see index_current())
+return: dirs,no_of_files or None when root cannot be stat-ed or listed (logged)
+"""
+def list_dir(root,root_entry=None):
+    if purge_index is not None:
+        try:
+            dir_mtime = root_entry.stat(follow_symlinks=False).st_mtime if root_entry is not None else os.stat(root).st_mtime
+        except OSError as e:
+            logger.warning('Unable to stat %s : %s', root, str(e))
+            add_metric('counters',None,errors=1)
+            return None
+        row = index_get('walk',root)
+        if index_current(row,dir_mtime):
+            return [IndexedEntry(root,name,symlink=symlink) for name,symlink in json.loads(row[3])],row[2]
+    listing = new_listing()
+    listed_at = time.time()
+    try:
+        with os.scandir(root) as entries:
+            for entry in entries:
+                add_to_listing(listing,entry)
+    except OSError as e:
+        logger.warning('Unable to list %s : %s', root, str(e))
+        add_metric('counters',None,errors=1)
+        return None
+    if purge_index is not None:
+        index_put_walk(root,dir_mtime,listing['files'],listing['dirs'],listed_at)
+    return listing['dirs'],listing['files']
+
+"""
+new_listing(): Sub-directories (os.DirEntry) and file count of one directory, filled entry by entry by add_to_listing()
+"""
+def new_listing():
+    return {'dirs': [], 'files': 0, 'complete': False}
+
+def add_to_listing(listing,entry):
+    try:
+        is_dir = entry.is_dir()
+    except OSError:
+        is_dir = False
+    if is_dir:
+        listing['dirs'].append(entry)
+    else:
+        listing['files'] += 1
+
+"""
+record_deleted_dir(root): Thread safe append to the module level deleted_dirs list
+"""
+deleted_dirs = []
+deleted_dirs_lock = threading.Lock()
+def record_deleted_dir(root):
+    with deleted_dirs_lock:
+        deleted_dirs.append(root)
+
+"""
+del_dirs(): Deletes the directories under src_dir selected by the dir rules of the rule table (see load_rules())
+STEP 1 : Find the first dir rule matching the dir name (by default: name starting with a 3 or 4, or with any other digit)
+STEP 2 : If the dir is older than the min_age of that rule (by default 365 days for 3/4, 30 days for other digits), delete it
+STEP 3 : If no rule matches or it is not old enough, probe the sub-dirs and check STEP 1
+Deleted directories are pruned from the walk and subtrees matching dir_skip_patterns/dir_max_depth are never probed
+Leftover trash directories of an interrupted rmtree_background delete are removed (planned in plan mode) when found
+root_entry/depth start the walk at a single subtree of a dirs_to_del_list root (see del_dirs_concurrently())
+return: list of directories deleted by this call
+"""
+def del_dirs(src_dir,root_entry=None,depth=0):
+    deleted_here = []
+    for root, root_entry, depth, dirs, no_of_files in walk_dirs(src_dir,dir_skip_patterns,dir_max_depth,root_entry,depth):
+        if root_entry is None:
+            continue
+        outcome = probe_dir(root,root_entry,depth,len(dirs),no_of_files)
+        if outcome == 'deleted':
+            deleted_here.append(root)
+        if outcome is not None:
+            dirs[:] = []
+    return deleted_here
+
+"""
+probe_dir(root,root_entry,depth,no_of_dirs,no_of_files): STEPS 1 and 2 of del_dirs() for one directory found by the walk
+return: 'deleted' when root was deleted, 'trash' when it was a leftover trash directory (removed or planned), None when it is kept and its
+        sub-directories have to be probed
+"""
+def probe_dir(root,root_entry,depth,no_of_dirs,no_of_files):
+    add_metric('counters',None,dirs_probed=1)
+    leaf_dir = root_entry.name
+    if leaf_dir.startswith(trash_prefix):
+        if root not in background_trash:
+            logger.info('%s was left behind by an interrupted background delete. %s', root, 'Planning its deletion' if purge_mode == 'plan' else 'Removing it')
+            try:
+                remove_expired_dir(root,trash_rule,root_entry.stat(follow_symlinks=False))
+            except OSError as e:
+                logger.warning('Unable to remove %s : %s', root, str(e))
+        return 'trash'
+    rule = match_rule(purge_rules['dir'],leaf_dir,depth)
+    if rule is not None:
+        if root in purged_sections:
+            logger.info('%s had files deleted by its config section in this run. Hence its not being deleted, its sub-directories are probed', root)
+            return None
+        try:
+            dir_stat = root_entry.stat(follow_symlinks=False)
+        except OSError as e:
+            logger.warning('Unable to stat %s : %s', root, str(e))
+            return None
+        age = run_started - dir_stat.st_mtime
+        if del_dir_by_rule(root,rule,no_of_dirs,no_of_files,age,dir_stat):
+            return 'deleted'
+    return None
+
+"""
+Merged traversal (not in async_mode): config sections below a dirs_to_del_list root, or that are the root itself (the default
+base_path layout), are not scanned on their own. The del_dirs()
+walk purges their files when it reaches them, from the same os.scandir pass that lists the directory for the walk, so every
+directory is listed once per run (the time of those sections counts in the dirs phase). A section whose files were deleted got a
+new mtime, so as with the separate passes its directory is not deleted by a dir rule in the same run. Sections the walk does not
+reach (below a skipped, symlinked or deleted directory, or when the walk failed) are purged on their own after the walk
+walk_sections: normalized section path -> section_config of the sections purged by the walk
+walk_results: normalized section path -> result of purge_section() for the sections done by the walk
+purged_sections: normalized paths of the sections with files deleted by the walk
+"""
+walk_sections = {}
+walk_results = {}
+purged_sections = set()
+
+def is_below(path,root):
+    return path != root and path.startswith(root.rstrip('/')+'/')
+
+"""
+plan_traversal(sections,roots): Deduplicated roots of the del_dirs() walk and the split of the config sections between the walk
+                                and file_differences(). A root inside another root is dropped when the walk of the outer root
+                                probes it the same way (no dir_skip_patterns, dir_max_depth or depth limited dir rule)
+return: roots, dict of walk_sections, list of the sections left to file_differences()
+"""
+def plan_traversal(sections,roots):
+    merged = []
+    for root in map(os.path.normpath,roots):
+        if root in merged:
+            logger.info('%s is listed more than once in dirs_to_del_list. It is walked once', root)
+        else:
+            merged.append(root)
+    if not dir_skip_patterns and dir_max_depth is None and all(rule.max_depth is None for rule in purge_rules['dir'].rules):
+        for root in list(merged):
+            outer = [other for other in merged if is_below(root,other)]
+            if outer:
+                logger.info('%s is inside %s. Its directories are probed by the walk of %s', root, outer[0], outer[0])
+                merged.remove(root)
+    walked, own_sections = {}, []
+    for section_config in sections:
+        path = os.path.normpath(section_config.section)
+        if any(path == root or is_below(path,root) for root in merged):
+            walked[path] = section_config
+        else:
+            own_sections.append(section_config)
+    return merged,walked,own_sections
+
+"""
+purge_walk_section(root,root_entry,section_config): Purges the files of a config section reached by the walk and returns the
+                                                    listing of the directory for the walk, from the same scan. The file count
+                                                    leaves out the files deleted. Falls back to list_dir() when the scan did
+                                                    not run to its end (unusable section, incremental index, error)
+return: dirs,no_of_files or None (see list_dir())
+"""
+def purge_walk_section(root,root_entry,section_config):
+    listing = new_listing()
+    result = purge_section(section_config,listing)
+    walk_results[root] = result
+    if result['deleted'] > 0 and purge_mode == 'execute':
+        purged_sections.add(root)
+    if not listing['complete']:
+        return list_dir(root,root_entry)
+    return listing['dirs'],listing['files']-(result['deleted'] if purge_mode == 'execute' else 0)
+
+"""
+finish_walk_sections(config,section_results): Purges the walk_sections the walk did not reach and merges their results with the
+                                              ones of file_differences()
+return: list of per-section results in config order
+"""
+def finish_walk_sections(config,section_results):
+    if not walk_sections:
+        return section_results
+    for path,section_config in walk_sections.items():
+        if path in walk_results:
+            continue
+        removed = [dir for dir in deleted_dirs if is_below(path,os.path.normpath(dir))]
+        if removed:
+            logger.info('PROCESSING :  %s', section_config.section)
+            logger.info('%s was %s with %s', section_config.section, 'planned for deletion' if purge_mode == 'plan' else 'deleted', removed[0])
+            walk_results[path] = {'section': section_config.section, 'deleted': 0, 'deleted_bytes': 0, 'stat_calls': 0}
+        else:
+            walk_results[path] = purge_section(section_config)
+    results = dict((result['section'],result) for result in section_results)
+    results.update((result['section'],result) for result in walk_results.values())
+    return [results[section.section] for section in config['sections'] if section.section in results]
+
+"""
+del_dirs_concurrently(src_dirs,workers): Splits every root in src_dirs into its top-level subtrees and runs del_dirs() on each
+                                          subtree on a pool of workers threads
+return: list of directories deleted
+"""
+def del_dirs_concurrently(src_dirs,workers):
+    tasks = [(del_dirs,(entry.path,entry,1)) for entry in top_level_subtrees(src_dirs)]
+    deleted = []
+    for result in run_concurrently(tasks,workers):
+        if result is not None:
+            deleted.extend(result)
+    return deleted
+
+"""
+top_level_subtrees(src_dirs): The directories right below every root in src_dirs that del_dirs() would probe. A root that is a
+                              config section of the walk is listed by the purge of its files (see purge_walk_section())
+return: list of os.DirEntry
+"""
+def top_level_subtrees(src_dirs):
+    subtrees = []
+    for src_dir in src_dirs:
+        section_config = walk_sections.get(src_dir)
+        if section_config is not None:
+            listing = purge_walk_section(src_dir,None,section_config)
+            dirs = listing[0] if listing is not None else []
+        else:
+            try:
+                with os.scandir(src_dir) as entries:
+                    dirs = [entry for entry in entries if entry.is_dir()]
+            except OSError as e:
+                logger.warning('Unable to list %s : %s', src_dir, str(e))
+                continue
+        subtrees.extend(entry for entry in dirs if not entry.is_symlink() and not skip_subtree(entry.name,1,dir_skip_patterns,dir_max_depth))
+    return subtrees
+
+"""
+Async mode (async_mode = True): for network filesystems (NFS) where each stat/unlink waits on a server round trip. The decisions
+are the ones of the threaded code (same pipeline stages, is_excluded() matcher, rule table and probe_dir()), only the blocking
+calls are issued from asyncio tasks onto a thread pool, so many of them are in flight at once. Each mount gets its own limit of
+async_concurrency_per_mount calls in flight, so one slow server does not take the slots of another
+"""
+
+"""
+mount_point(path): Mount point holding path
+return: path of the mount point
+"""
+def mount_point(path):
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+"""
+MountLimiter(paths): Thread pool and per-mount semaphores used by the async mode. The pool is sized for async_concurrency_per_mount
+                     calls on each mount holding one of paths
+run(path,func,*args): Runs the blocking func(*args) on the pool once the mount of path has a free slot. The call runs in a copy of
+                      the current context, so its log records land in the log buffer of the calling task (see run_grouped_async())
+"""
+class MountLimiter(object):
+    def __init__(self,paths):
+        self.mounts = {}
+        mounts = set(self.mount(path) for path in paths)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=async_concurrency_per_mount*max(1,len(mounts)))
+        self.semaphores = {}
+
+    def mount(self,path):
+        if path not in self.mounts:
+            try:
+                self.mounts[path] = mount_point(path)
+            except OSError:
+                self.mounts[path] = path
+        return self.mounts[path]
+
+    async def run(self,path,func,*args):
+        mount = self.mount(path)
+        if mount not in self.semaphores:
+            self.semaphores[mount] = asyncio.Semaphore(async_concurrency_per_mount)
+        async with self.semaphores[mount]:
+            return await asyncio.get_running_loop().run_in_executor(self.executor,contextvars.copy_context().run,func,*args)
+
+"""
+run_async(func,paths,*args): Runs the coroutine function func(limiter,*args) in a new event loop with a MountLimiter for paths
+return: result of func
+"""
+def run_async(func,paths,*args):
+    limiter = MountLimiter(paths)
+    try:
+        return asyncio.run(func(limiter,*args))
+    finally:
+        limiter.executor.shutdown()
+
+"""
+run_grouped_async(coro,name): Async counterpart of run_grouped(), the log records of one task are buffered in its own context
+return: result of coro (None if it raised) and the buffered log records
+"""
+async def run_grouped_async(coro,name):
+    records = []
+    log_buffer.set(records)
+    result = None
+    try:
+        result = await coro
+    except Exception as e:
+        logger.error("An error occured when processing %s: %s", name, str(e))
+    finally:
+        log_buffer.set(None)
+    return result,records
+
+"""
+prime_stat(entry): Stats an entry on the pool so the stat is cached on it before expired_entries() looks at it. A DirEntry does not
+                   show that its stat is cached, so entry_stat() still counts it; other entries are counted here
+"""
+def prime_stat(entry):
+    try:
+        entry.stat()
+    except OSError:
+        pass
+
+"""
+run_file_pipeline_async(context,limiter): run_file_pipeline() for async mode. The section is listed and matched against the exclude
+                                          list in batches of age_batch_size entries on the pool. The batch is then stat-ed with
+                                          concurrent calls (the stat is cached on the entries), aged by expired_entries() and its
+                                          expired files removed with concurrent calls. Custom file_purge_stages are not used here.
+                                          The scan phase timer includes the matching against the exclude list
+return: context
+"""
+async def run_file_pipeline_async(context,limiter):
+    section, timers = context['section'], context['timers']
+    candidates = exclude_entries(scan_entries(context),context)
+    try:
+        while True:
+            started = time.perf_counter()
+            batch = await limiter.run(section,list,itertools.islice(candidates,age_batch_size))
+            checked = time.perf_counter()
+            timers['scan'] = timers.get('scan',0.0)+checked-started
+            if len(batch) == 0:
+                break
+            unstated = [entry for entry in batch if getattr(entry,'cached',None) is None]
+            context['stat_counter']['stat'] += sum(1 for entry in unstated if isinstance(entry,IndexedEntry))
+            await asyncio.gather(*[limiter.run(section,prime_stat,entry) for entry in unstated])
+            expired = list(expired_entries(iter(batch),context))
+            started = time.perf_counter()
+            timers['age_check'] = timers.get('age_check',0.0)+started-checked
+            if purge_mode == 'plan':
+                outcomes = [None]*len(expired)
+            else:
+                outcomes = await asyncio.gather(*[limiter.run(section,throttled,os.remove,section+entry.name,file_stat.st_size) for entry,file_stat,age,rule in expired],return_exceptions=True)
+            for (entry,file_stat,age,rule),outcome in zip(expired,outcomes):
+                if isinstance(outcome,Exception):
+                    logger.error("An error occured when processing delete_files operation: %s",str(outcome))
+                    context['errors'] += 1
+                    continue
+                file_deleted(context,entry,file_stat,age,rule)
+            timers['delete'] = timers.get('delete',0.0)+time.perf_counter()-started
+    except Exception as e:
+        logger.error("An error occured when processing delete_files operation: %s",str(e))
+        context['errors'] += 1
+    finally:
+        candidates.close()
+    return context
+
+"""
+purge_section_async(limiter,section_config): purge_section() for async mode
+return: dict with the section, the number of deleted files and bytes and the number of stat calls
+"""
+async def purge_section_async(limiter,section_config):
+    section = section_config.section
+    result = {'section': section, 'deleted': 0, 'deleted_bytes': 0, 'stat_calls': 0}
+    logger.info('PROCESSING :  %s', section)
+    started = time.perf_counter()
+    context = await limiter.run(section,section_context,section_config)
+    if context is not None:
+        try:
+            await run_file_pipeline_async(context,limiter)
+            await limiter.run(section,finish_section,context,result)
+        except Exception as e:
+            log_section_error(section,e)
+        record_section_metrics(context,time.perf_counter()-started)
+    return result
+
+"""
+file_differences_async(limiter,config): file_differences() for async mode. All sections are purged at the same time; the log of
+                                        each section is written out as one block, in config order
+return: list of per-section results
+"""
+async def file_differences_async(limiter,config):
+    results = []
+    sections = config['sections']
+    if len(sections) == 0:
+        logger.warning('File ops_files_purge_exceptions.cfg is empty')
+        return results
+    tasks = [asyncio.ensure_future(run_grouped_async(purge_section_async(limiter,section),section.section)) for section in sections]
+    for task in tasks:
+        result,records = await task
+        for record in records:
+            logger.handle(record)
+        if result is not None:
+            results.append(result)
+    return results
+
+"""
+del_dirs_async(limiter,src_dirs): del_dirs() for async mode. Directories of all roots in src_dirs are listed and probed by a pool of
+                                  tasks sharing one work queue; each probe_dir() runs on the thread pool and its log is written
+                                  out as one block. Deleted and trash directories are not descended into
+return: list of directories deleted
+"""
+async def del_dirs_async(limiter,src_dirs):
+    work = asyncio.Queue()
+    deleted = []
+    for src_dir in src_dirs:
+        work.put_nowait((src_dir,src_dir,None,0))
+
+    async def worker():
+        while True:
+            src_dir,root,root_entry,depth = await work.get()
+            try:
+                listing = await limiter.run(src_dir,list_dir,root,root_entry)
+                if listing is None:
+                    continue
+                dirs, no_of_files = listing
+                if root_entry is not None:
+                    outcome,records = await limiter.run(src_dir,run_grouped,probe_dir,root,root_entry,depth,len(dirs),no_of_files)
+                    for record in records:
+                        logger.handle(record)
+                    if outcome == 'deleted':
+                        deleted.append(root)
+                    if outcome is not None:
+                        continue
+                for entry in dirs:
+                    if entry.is_symlink() or skip_subtree(entry.name,depth+1,dir_skip_patterns,dir_max_depth):
+                        continue
+                    work.put_nowait((src_dir,entry.path,entry,depth+1))
+            except Exception as e:
+                logger.error("An error occured when processing del_dirs operation: %s",str(e))
+            finally:
+                work.task_done()
+
+    workers = [asyncio.ensure_future(worker()) for i in range(async_concurrency_per_mount*len(set(map(limiter.mount,src_dirs))))]
+    await work.join()
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(*workers,return_exceptions=True)
+    return deleted
+
+"""
+tree_usage(root): Recursive size in bytes and number of inodes below a directory (root itself not included), used to size
+                  directories in a purge plan
+return: total_bytes,total_inodes
+"""
+def tree_usage(root):
+    total_bytes, total_inodes = 0, 0
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    try:
+                        entry_st = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    total_bytes += entry_st.st_size
+                    total_inodes += 1
+                    if stat.S_ISDIR(entry_st.st_mode):
+                        stack.append(entry.path)
+        except OSError:
+            continue
+    return total_bytes,total_inodes
+
+"""
+add_plan_entry(path,kind,size,mtime,rule): Records one path selected for deletion while running with purge_mode = 'plan'
+"""
+plan_entries = []
+plan_entries_lock = threading.Lock()
+def add_plan_entry(path,kind,size,mtime,rule):
+    with plan_entries_lock:
+        plan_entries.append({'path': path, 'type': kind, 'size': size, 'mtime': mtime, 'rule': rule})
+
+"""
+write_plan(plan_file): Serializes the collected plan as JSON lines. The first line is a header with the planning time, every other
+                       line is one path with its type, size, mtime, age in hours and the rule that selected it
+return: number of planned paths
+"""
+def write_plan(plan_file):
+    planned_at = run_started
+    tmp_file = plan_file+'.tmp'
+    with open(tmp_file,'w') as plan:
+        plan.write(json.dumps({'planned_at': planned_at, 'paths': len(plan_entries)})+'\n')
+        for entry in plan_entries:
+            entry = dict(entry, age_hrs=round((planned_at-entry['mtime'])/3600, 1))
+            plan.write(json.dumps(entry,separators=(',',':'))+'\n')
+    os.replace(tmp_file,plan_file)
+    logger.info('Purge plan with %s path(s) and %s byte(s) written to %s', len(plan_entries), sum(entry['size'] for entry in plan_entries), plan_file)
+    return len(plan_entries)
+
+"""
+rule_limit(rule): Age limit in seconds of a plan rule in the applying run. A leftover trash directory (trash_rule) has none
+return: the limit, or None if no rule of that name is known (renamed or removed since the plan was made)
+rule_expired(rule,mtime): Re-evaluates the age condition of a plan rule against run_started of the applying run
+return: True if the path is still old enough to be deleted
+"""
+def rule_limit(rule):
+    if rule == trash_rule:
+        return 0
+    if rule in pressure_min_age:
+        return pressure_min_age[rule]
+    return age_limits.get(rule)
+
+def rule_expired(rule,mtime):
+    return run_started - mtime > rule_limit(rule)
+
+"""
+apply_plan(plan_file): Deletes the paths of a saved purge plan. Every path is stat-ed again at delete time and skipped if it is gone,
+                       its mtime changed since the plan was made or it no longer satisfies the rule that selected it. A path whose
+                       rule is unknown is skipped with a warning; an unreadable entry or a failed delete is logged and the rest of
+                       the plan is still applied (see apply_plan_entry())
+return: number of deleted paths
+"""
+def apply_plan(plan_file):
+    counts = {'deleted': 0, 'skipped': 0, 'errors': 0}
+    with open(plan_file) as plan:
+        header = json.loads(plan.readline())
+        logger.info('Applying purge plan %s made on %s with %s path(s)', plan_file, datetime.datetime.fromtimestamp(header['planned_at']), header['paths'])
+        for line_no, line in enumerate(plan, 2):
+            try:
+                entry = json.loads(line)
+                outcome = apply_plan_entry(entry,plan_file)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error('Line %s of the purge plan %s is not a valid entry. Skipped : %s', line_no, plan_file, str(e))
+                outcome = 'errors'
+            except OSError as e:
+                logger.error("An error occured when deleting %s from the purge plan: %s", entry['path'], str(e))
+                outcome = 'errors'
+            counts[outcome] += 1
+    if counts['errors']:
+        add_metric('counters',None,errors=counts['errors'])
+    logger.info('Purge plan applied : %s path(s) deleted, %s skipped, %s error(s)', counts['deleted'], counts['skipped'], counts['errors'])
+    return counts['deleted']
+
+"""
+apply_plan_entry(entry,plan_file): Re-checks and deletes one path of a purge plan
+return: 'deleted' or 'skipped'
+"""
+def apply_plan_entry(entry,plan_file):
+    path, rule = entry['path'], entry['rule']
+    try:
+        path_stat = os.lstat(path)
+    except OSError:
+        logger.info('%s no longer exists. Skipped', path)
+        return 'skipped'
+    if rule_limit(rule) is None:
+        logger.warning('%s was planned by the rule %s, which is not in the current rule table. Hence its not being deleted', path, rule)
+        audit('kept',path,reason='unknown_rule',rule=rule,plan=plan_file)
+        return 'skipped'
+    if path_stat.st_mtime != entry['mtime'] or not rule_expired(rule,path_stat.st_mtime):
+        logger.info('%s was modified after the plan was made. Hence its not being deleted', path)
+        audit('kept',path,reason='modified_since_plan',plan=plan_file)
+        return 'skipped'
+    if entry['type'] == 'dir':
+        record_deleted_dir(path)
+        remove_dir_tree(path,rule)
+    else:
+        throttled(os.remove,path,path_stat.st_size)
+        account_reclaimed(os.path.dirname(path)+'/',rule,path_stat.st_size,1)
+    logger.info('Deleted %s %s (%s)', entry['type'], path, rule)
+    audit('deleted',path,type=entry['type'],size=entry['size'],rule=rule,plan=plan_file)
+    return 'deleted'
+
+"""
+Disk pressure (disk_pressure = True): the rule table retention (48 hours, 365/30 days by default) is applied first as always. Files and directories
+it keeps only because they are too young, but older than pressure_min_age, are remembered during that same scan on a heap per
+filesystem, oldest first. Filesystems that already meet their free space/inode targets when first seen get no heap. Once the normal
+purge is done, relieve_disk_pressure() pops the oldest candidates of every filesystem still short of its targets and deletes them
+until the targets are met
+"""
+pressure_heaps = {}
+pressure_mounts = {}
+pressure_lock = threading.Lock()
+
+"""
+pressure_shortfall(mount): Free space and free inodes missing on a mount to meet free_space_target/free_inodes_target
+return: bytes,inodes (0,0 when the mount meets both targets)
+"""
+def pressure_shortfall(mount):
+    fs = os.statvfs(mount)
+    missing_bytes = max(0,int(fs.f_blocks*free_space_target) - fs.f_bavail)*fs.f_frsize
+    missing_inodes = max(0,int(fs.f_files*free_inodes_target) - fs.f_favail) if fs.f_files else 0
+    return missing_bytes,missing_inodes
+
+"""
+keep_under_pressure(path,rule,age,path_stat): Called for every file/directory kept by the fixed retention. Adds it to the heap of its
+                                              filesystem when disk_pressure is on and it is older than pressure_min_age[rule]
+"""
+def keep_under_pressure(path,rule,age,path_stat):
+    if not disk_pressure or age <= pressure_min_age[rule]:
+        return
+    try:
+        if path_stat is None:
+            path_stat = os.lstat(path)
+        dev = getattr(path_stat,'st_dev',None)
+        if dev is None:
+            dev = os.lstat(path).st_dev
+        with pressure_lock:
+            if dev not in pressure_heaps:
+                mount = mount_point(path)
+                pressure_mounts[dev] = mount
+                pressure_heaps[dev] = [] if pressure_shortfall(mount) != (0,0) else None
+                logger.info('Disk pressure check of %s : %s', mount, 'below target, collecting candidates' if pressure_heaps[dev] is not None else 'targets met')
+            if pressure_heaps[dev] is not None:
+                heapq.heappush(pressure_heaps[dev],(path_stat.st_mtime,path,rule))
+    except OSError as e:
+        logger.warning('Unable to check the disk pressure for %s : %s', path, str(e))
+
+"""
+relieve_disk_pressure(): Deletes (or, in plan mode, plans) the oldest candidates of every filesystem below its targets until the
+                         targets are met. Each candidate is lstat-ed again and skipped if it changed since the scan. The space freed
+                         is counted from the deletes and statvfs is only read again once the count says the target is reached.
+                         In plan mode nothing is freed, so the count alone decides
+return: number of paths deleted
+"""
+def relieve_disk_pressure():
+    deleted = 0
+    for dev,heap in pressure_heaps.items():
+        if not heap:
+            continue
+        mount = pressure_mounts[dev]
+        missing_bytes,missing_inodes = pressure_shortfall(mount)
+        if (missing_bytes,missing_inodes) == (0,0):
+            logger.info('Disk pressure on %s relieved by the normal purge', mount)
+            continue
+        logger.info('Disk pressure on %s : %s byte(s) and %s inode(s) short of the targets, %s candidate(s)', mount, missing_bytes, missing_inodes, len(heap))
+        freed_paths, freed_bytes, freed_inodes = 0, 0, 0
+        while heap and (missing_bytes > 0 or missing_inodes > 0):
+            mtime,path,rule = heapq.heappop(heap)
+            try:
+                path_stat = os.lstat(path)
+            except OSError:
+                continue
+            is_dir = rule == 'pressure_dirs'
+            if path_stat.st_mtime != mtime or not (stat.S_ISDIR(path_stat.st_mode) if is_dir else stat.S_ISREG(path_stat.st_mode)):
+                logger.info('%s was modified since it was scanned. Hence its not being deleted', path)
+                continue
+            age = run_started - mtime
+            if is_dir:
+                record_deleted_dir(path)
+                if purge_mode == 'plan':
+                    tree_bytes,tree_inodes = tree_usage(path)
+                    tree_bytes,tree_inodes = tree_bytes+path_stat.st_size,tree_inodes+1
+                else:
+                    report = remove_tree(path,rmtree_threads,rule)
+                    log_remove_report(report)
+                    index_forget(path)
+                    tree_bytes,tree_inodes = report['bytes'],report['inodes']
+            else:
+                if purge_mode != 'plan':
+                    try:
+                        throttled(os.remove,path,path_stat.st_size)
+                    except OSError as e:
+                        logger.error("An error occured when processing delete_files operation: %s",str(e))
+                        continue
+                tree_bytes,tree_inodes = path_stat.st_blocks*512,1
+            if purge_mode == 'plan':
+                add_plan_entry(path,'dir' if is_dir else 'file',tree_bytes,mtime,rule)
+            if purge_mode == 'plan' or not is_dir:
+                account_reclaimed(owning_root(path),rule,tree_bytes,tree_inodes)
+            logger.info('%s %s %s, %s old, to relieve disk pressure on %s', 'Planned deletion of' if purge_mode == 'plan' else 'Deleted', 'directory' if is_dir else 'file', path, '%s day(s)' % round(age/86400) if is_dir else '%s hour(s)' % round(age/3600), mount)
+            audit('planned' if purge_mode == 'plan' else 'deleted',path,type='dir' if is_dir else 'file',size=tree_bytes,rule=rule,mount=mount)
+            freed_paths, freed_bytes, freed_inodes = freed_paths+1, freed_bytes+tree_bytes, freed_inodes+tree_inodes
+            missing_bytes, missing_inodes = missing_bytes-tree_bytes, missing_inodes-tree_inodes
+            if missing_bytes <= 0 and missing_inodes <= 0 and purge_mode != 'plan':
+                missing_bytes,missing_inodes = pressure_shortfall(mount)
+        deleted += freed_paths
+        logger.info('Disk pressure on %s : %s path(s), %s byte(s) and %s inode(s) %s, targets %s', mount, freed_paths, freed_bytes, freed_inodes, 'planned for deletion' if purge_mode == 'plan' else 'freed', 'met' if missing_bytes <= 0 and missing_inodes <= 0 else 'still not met')
+    return deleted
+
+"""
+Sharding (shard_count set, not in async_mode): several hosts mounting the same trees run the same purge and split it instead of
+repeating it. The work units, the config sections and the top-level subtrees of the dirs_to_del_list roots (a section below a
+root goes with the subtree holding it), are spread over shard_count shards by a stable hash of their path. A host claims one
+shard at a time by creating its lease file in shard_lease_dir with O_CREAT|O_EXCL, the only coordination used, purges it and
+claims the next free one, so the shards are spread over the hosts running and all of them are done as long as one host runs.
+A lease is renewed while its shard runs and stays after it, marked done; a lease older than shard_lease_seconds (a finished
+shard of an earlier run, or the shard of a host that died) can be taken over. Each host starts at a different shard
+"""
+
+"""
+stable_hash(key): Hash of a string that is the same on every host and run (unlike hash())
+shard_of(path,roots): Shard of the work unit holding path
+"""
+def stable_hash(key):
+    return int(hashlib.sha256(key.encode('utf-8','surrogateescape')).hexdigest()[:16],16)
+
+def shard_of(path,roots):
+    for root in roots:
+        if is_below(path,root):
+            path = os.path.join(root,os.path.relpath(path,root).split(os.sep)[0])
+            break
+    return stable_hash(path) % shard_count
+
+"""
+write_lease(path,state,flags): Writes the lease file path (host, pid, state and time), flags O_CREAT|O_EXCL to claim it
+lease_expired(path): True if the lease file path was not renewed for shard_lease_seconds (or is gone)
+"""
+def write_lease(path,state,flags=os.O_TRUNC):
+    fd = os.open(path,os.O_WRONLY|flags,0o644)
+    with os.fdopen(fd,'w') as lease:
+        json.dump({'host': socket.gethostname(), 'pid': os.getpid(), 'state': state, 'at': time.time()},lease)
+
+def lease_expired(path):
+    try:
+        return time.time()-os.stat(path).st_mtime > shard_lease_seconds
+    except FileNotFoundError:
+        return True
+
+"""
+claim_lease(path): Creates the lease file path with O_CREAT|O_EXCL. An expired lease is taken over under a second O_EXCL file,
+                   path+".takeover", so only one host removes and re-creates it
+return: True if the lease is now held by this process
+"""
+def claim_lease(path):
+    try:
+        write_lease(path,'running',os.O_CREAT|os.O_EXCL)
+        return True
+    except FileExistsError:
+        if not lease_expired(path):
+            return False
+    takeover = path+'.takeover'
+    try:
+        write_lease(takeover,'takeover',os.O_CREAT|os.O_EXCL)
+    except FileExistsError:
+        if lease_expired(takeover):
+            os.unlink(takeover)
+        return False
+    try:
+        if not lease_expired(path):
+            return False
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        try:
+            write_lease(path,'running',os.O_CREAT|os.O_EXCL)
+            return True
+        except FileExistsError:
+            return False
+    finally:
+        os.unlink(takeover)
+
+"""
+ShardLease(shard): Lease of one shard, renewed by a thread every quarter of shard_lease_seconds while it is held
+claim(): True if the shard is now held by this process
+release(): Stops the renewal and marks the lease done. The file stays, so the shard is not purged again before it expires
+"""
+class ShardLease(object):
+    def __init__(self,shard):
+        self.shard = shard
+        self.path = os.path.join(shard_lease_dir,'shard-%s-of-%s.lease' % (shard,shard_count))
+        self.stopped = threading.Event()
+        self.renewer = None
+
+    def claim(self):
+        if not claim_lease(self.path):
+            return False
+        self.renewer = threading.Thread(target=self.renew,name='shard-lease-%s' % self.shard,daemon=True)
+        self.renewer.start()
+        return True
+
+    def renew(self):
+        while not self.stopped.wait(shard_lease_seconds/4.0):
+            try:
+                os.utime(self.path)
+            except OSError as e:
+                logger.warning('Unable to renew the lease %s : %s', self.path, str(e))
+
+    def release(self):
+        self.stopped.set()
+        self.renewer.join()
+        try:
+            write_lease(self.path,'done')
+        except OSError as e:
+            logger.warning('Unable to mark the lease %s done : %s', self.path, str(e))
+
+"""
+run_shards(config): Purges the shards this host can claim, one after the other: the files of the sections of the shard, then its
+                    subtrees (see del_dirs()). Sections below a root are purged by the walk of their subtree (see plan_traversal())
+return: list of per-section results
+"""
+def run_shards(config):
+    results = []
+    try:
+        os.makedirs(shard_lease_dir,exist_ok=True)
+    except OSError as e:
+        logger.error('Unable to create the shard lease directory %s, nothing is purged : %s', shard_lease_dir, str(e))
+        return results
+    roots,walked,own_sections = plan_traversal(config['sections'],dirs_to_del_list)
+    subtrees = top_level_subtrees(roots)
+    start = stable_hash('%s:%s' % (socket.gethostname(),os.getpid())) % shard_count
+    for shard in [(start+i) % shard_count for i in range(shard_count)]:
+        lease = ShardLease(shard)
+        try:
+            if not lease.claim():
+                logger.info('Shard %s of %s is taken (%s). Skipped', shard, shard_count, lease.path)
+                continue
+        except OSError as e:
+            logger.error('Unable to claim the lease %s : %s', lease.path, str(e))
+            continue
+        try:
+            logger.info('Shard %s of %s claimed (%s)', shard, shard_count, lease.path)
+            add_metric('counters',None,shards_claimed=1)
+            walk_sections.update((path,section) for path,section in walked.items() if shard_of(path,roots) == shard)
+            with timed('phases','files'):
+                results.extend(file_differences(config,[section for section in own_sections if shard_of(os.path.normpath(section.section),roots) == shard]))
+            with timed('phases','dirs'):
+                tasks = [(del_dirs,(entry.path,entry,1)) for entry in subtrees if shard_of(entry.path,roots) == shard]
+                if purge_workers > 1:
+                    run_concurrently(tasks,purge_workers)
+                else:
+                    for func,args in tasks:
+                        func(*args)
+        except Exception as e:
+            logger.error("An error occured when processing shard %s: %s", shard, str(e))
+        finally:
+            lease.release()
+    return results
+
+"""
+start_run_state(): Starts the throttle and the audit stream of a run (see start_throttle() and start_audit_log())
+hold_run_state(): Context manager for a long-lived caller deleting between runs (ops_purge.daemon). The throttle and the audit
+                  stream are started once for the whole block and every run_purge() inside it keeps them, so those deletes are
+                  throttled and audited like the ones of a run
+"""
+run_state_held = False
+def start_run_state():
+    start_throttle()
+    if audit_log_path is not None:
+        try:
+            start_audit_log(audit_log_path)
+        except OSError as e:
+            logger.error("Unable to open the audit log %s: %s", audit_log_path, str(e))
+
+@contextlib.contextmanager
+def hold_run_state():
+    global run_state_held
+    start_run_state()
+    run_state_held = True
+    try:
+        yield
+    finally:
+        run_state_held = False
+        stop_audit_log()
+
+"""
+run_purge(): Runs one purge with the settings of the Variable Declaration block. Logging is configured by the caller
+             (see ops_purge.Purger.run())
+return: dict with the per-section results, the deleted directories and the run metrics
+"""
+def run_purge():
+    global run_started, purge_index
+    del deleted_dirs[:]
+    del plan_entries[:]
+    pressure_heaps.clear()
+    pressure_mounts.clear()
+    walk_sections.clear()
+    walk_results.clear()
+    purged_sections.clear()
+    reset_metrics()
+    section_results = []
+    run_started = time.time()
+    run_timer = time.perf_counter()
+    header_footer("begin")
+    if not run_state_held:
+        start_run_state()
+    if incremental_index and purge_mode != 'apply':
+        try:
+            purge_index = open_index(purge_index_file)
+            logger.info('Using incremental index %s%s', purge_index_file, ' (full rescan)' if full_rescan else '')
+        except sqlite3.Error as e:
+            logger.error("Unable to open the incremental index %s, running a full scan: %s", purge_index_file, str(e))
+    if purge_mode == 'apply':
+        rules = load_rules(rules_file)
+        if rules is not None:
+            set_rules(rules)
+            try:
+                apply_plan(purge_plan_file)
+            except Exception as e:
+                logger.error("An error occured when applying the purge plan %s: %s", purge_plan_file, str(e))
+        config = None
+    else:
+        with timed('phases','config_load'):
+            config = load_config()
+        if config is not None:
+            set_rules(config['rules'])
+    if config is not None:
+        roots = dirs_to_del_list
+        sharded = shard_count is not None and not async_mode
+        if shard_count is not None and async_mode:
+            logger.warning('shard_count is not used in async_mode. This host purges everything')
+        try:
+            if sharded:
+                section_results = run_shards(config)
+            else:
+                with timed('phases','files'):
+                    if async_mode:
+                        section_results = run_async(file_differences_async,[section.section for section in config['sections']],config)
+                    else:
+                        roots,walked,own_sections = plan_traversal(config['sections'],dirs_to_del_list)
+                        walk_sections.update(walked)
+                        section_results = file_differences(config,own_sections)
+        except OSError as error :
+            logger.error('%s', error)
+        try:
+            if not sharded:
+                logger.info('%s',seperator1)
+                logger.info('PROCESSING :  DELETION of directories older than an year under /adbadmin')
+                logger.info('%s',seperator1)
+                with timed('phases','dirs'):
+                    if async_mode:
+                        run_async(del_dirs_async,dirs_to_del_list,dirs_to_del_list)
+                    elif purge_workers > 1:
+                        del_dirs_concurrently(roots,purge_workers)
+                    else:
+                        for dir in roots:
+                            del_dirs(dir)
+            # logger.info('Deleted dir %s', [str(dir) for dir in deleted_dirs])
+            if len(deleted_dirs)!=0 and log_mode == 'summary':
+                logger.info('%s director(ies) %s, e.g.: \n\t\t\t\t\t > %s', len(deleted_dirs), 'planned for deletion' if purge_mode == 'plan' else 'deleted', name_sample(deleted_dirs))
+                logger.info('%s',seperator1)
+            elif len(deleted_dirs)!=0 and purge_mode == 'plan':
+                logger.info('The following directories would be deleted by the purge plan: \n\t\t\t\t\t > %s',  delim.join(list(map(str,deleted_dirs))))
+                logger.info('%s',seperator1)
+            elif len(deleted_dirs)!=0:
+                logger.info('The following directories were deleted in this execution: \n\t\t\t\t\t > %s',  delim.join(list(map(str,deleted_dirs))))
+                logger.info('%s',seperator1)
+        except Exception as e:
+            logger.error("An error occured when processing del_dirs operation: %s",str(e))
+        try:
+            section_results = finish_walk_sections(config,section_results)
+        except Exception as e:
+            logger.error("An error occured when processing file_differences function: %s",str(e))
+        for result in section_results:
+            logger.info('Section %s : %s file(s) deleted, %s stat call(s)', result['section'], result['deleted'], result['stat_calls'])
+        walk_sections.clear()
+        if disk_pressure:
+            try:
+                with timed('phases','disk_pressure'):
+                    wait_background_removals()
+                    relieve_disk_pressure()
+            except Exception as e:
+                logger.error("An error occured when relieving the disk pressure: %s",str(e))
+        if purge_mode == 'plan':
+            try:
+                write_plan(purge_plan_file)
+            except OSError as e:
+                logger.error("An error occured when writing the purge plan %s: %s", purge_plan_file, str(e))
+    wait_background_removals()
+    close_index()
+    if not run_state_held:
+        stop_audit_log()
+    add_metric('phases','total',seconds=time.perf_counter()-run_timer)
+    log_reclaimed()
+    log_phase_timings()
+    flush_metrics()
+    header_footer("end")
+    return {'sections': section_results, 'deleted_dirs': list(deleted_dirs), 'metrics': metrics_snapshot()}
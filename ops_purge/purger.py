@@ -0,0 +1,110 @@
+####################################################################################################################################
+# Description:                                                                                                                     #
+#               Purger: one purge job of ops_purge/engine.py with its settings passed as parameters instead of edited globals      #
+#               1. Purger(base_path=..., dirs_to_del_list=[...], purge_workers=4).run() returns a dict with the results            #
+#               2. Files kept in base_path (log, config, rules, plan, index, compiled config, shard leases) follow base_path       #
+#                  unless given                                                                                                    #
+#               3. The engine keeps its state in module globals, so runs in one process are serialized by run_lock; a daemon can   #
+#                  still run many jobs one after the other without paying interpreter startup each time                           #
+####################################################################################################################################
+
+import contextlib
+import logging
+import threading
+import time
+
+from ops_purge import engine
+
+"""
+Variable Declaration
+settings: Names of the engine globals a Purger can set. Anything else passed to Purger() is an error
+defaults: Engine values at import time, the starting point of every Purger
+"""
+settings = (
+    'base_path', 'log_file_path', 'config_file', 'rules_file', 'purge_plan_file', 'purge_index_file', 'config_cache_file',
+    'dirs_to_del_list', 'dir_skip_patterns', 'dir_max_depth', 'purge_workers', 'purge_mode', 'incremental_index', 'full_rescan',
+    'log_mode', 'log_sample_size', 'audit_log_path', 'rmtree_threads', 'rmtree_background', 'age_batch_size', 'async_mode',
+    'async_concurrency_per_mount', 'disk_pressure', 'free_space_target', 'free_inodes_target', 'pressure_min_age', 'metrics_path',
+    'metrics_format', 'throttle_ops_per_sec', 'throttle_bytes_per_sec', 'throttle_latency_target', 'shard_count',
+    'shard_lease_seconds', 'shard_lease_dir',
+)
+defaults = dict((name, getattr(engine, name)) for name in settings)
+base_path_files = [name for name in settings if name != 'base_path' and isinstance(defaults[name], str) and defaults[name].startswith(defaults['base_path'])]
+log_format = '%(asctime)s - %(levelname)-8s - %(message)s'
+run_lock = threading.RLock()
+
+class Purger(object):
+    """
+    Purger(base_path=None,**settings): A purge job. base_path moves every file of base_path_files along with it (e.g. the log
+                                       becomes base_path+"ops_files_purge.log") unless that setting is passed as well.
+                                       log_file_path=None leaves logging to the caller's own handlers
+    """
+    def __init__(self,base_path=None,**kwargs):
+        unknown = sorted(set(kwargs) - set(settings))
+        if unknown:
+            raise TypeError('Unknown purge setting(s): %s' % ', '.join(unknown))
+        self.settings = dict(defaults)
+        if base_path is not None:
+            base_path = engine.file_path_correction(base_path)
+            for name in base_path_files:
+                self.settings[name] = base_path+defaults[name][len(defaults['base_path']):]
+            self.settings['base_path'] = base_path
+        self.settings.update(kwargs)
+
+    def __repr__(self):
+        return 'Purger(%s)' % ', '.join('%s=%r' % (name, value) for name, value in sorted(self.settings.items()) if value != defaults[name])
+
+    """
+    applied(): Context manager setting the engine globals to this job's settings, and back to what they were afterwards
+    """
+    @contextlib.contextmanager
+    def applied(self):
+        with run_lock:
+            saved = dict((name, getattr(engine, name)) for name in settings)
+            for name, value in self.settings.items():
+                setattr(engine, name, value)
+            try:
+                yield
+            finally:
+                for name, value in saved.items():
+                    setattr(engine, name, value)
+
+    """
+    logged(): Context manager sending the log of engine.logger to log_file_path (appended, as before) for the duration of the
+              block. Only engine.logger gets the handler and the DEBUG level; the root logger and the other loggers of the host
+              process are left alone. Used inside applied()
+    """
+    @contextlib.contextmanager
+    def logged(self):
+        handler, level = None, engine.logger.level
+        if engine.log_file_path is not None:
+            handler = logging.FileHandler(engine.log_file_path)
+            handler.setFormatter(logging.Formatter(log_format))
+            engine.logger.addHandler(handler)
+            engine.logger.setLevel(logging.DEBUG)
+        try:
+            yield
+        finally:
+            if handler is not None:
+                engine.logger.removeHandler(handler)
+                handler.close()
+                engine.logger.setLevel(level)
+
+    """
+    run(): Runs the purge job. The log goes to log_file_path for the duration of the run (see logged())
+    return: dict with sections (per-section results), deleted_dirs, metrics (see engine.run_metrics), started (epoch) and seconds
+    """
+    def run(self):
+        with self.applied(), self.logged():
+            started = time.time()
+            result = engine.run_purge()
+        result.update(started=started, seconds=time.time()-started)
+        return result
+
+    """
+    check_config(): Validates the configuration of this job (see engine.check_config())
+    return: exit status, 0 when the configuration has no errors
+    """
+    def check_config(self):
+        with self.applied():
+            return engine.check_config()
@@ -0,0 +1,287 @@
+#!/usr/bin/python
+####################################################################################################################################
+# Description:                                                                                                                     #
+#               Benchmark harness for the ops_purge package                                                                        #
+#               1. Builds synthetic trees under a temp directory: config sections full of spool files with a controlled mtime      #
+#                  distribution and exclude patterns, plus a del_dirs() tree of digit-prefixed directories of a given depth        #
+#               2. Runs ops_purge.Purger(...).run() against the tree in a child process, once per scenario (a set of settings)    #
+#               3. Reports wall time, os level calls, stat calls counted by the purge, peak RSS and files/s                         #
+#               4. Saves the results as JSON so two versions can be compared with --compare                                        #
+# Usage:                                                                                                                           #
+#               python purge_benchmark.py --files 20000 --sections 4 --depth 3 --fanout 4 --output new.json --compare old.json    #
+#               python purge_benchmark.py --scenario 'workers8={"purge_workers": 8}'                                             #
+####################################################################################################################################
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from ops_purge import Purger
+
+"""
+Variable Declaration
+"""
+seperator1 = "-"*100
+default_scenarios = {
+    'sequential': {},
+    'workers_4': {'purge_workers': 4},
+    'summary_log': {'log_mode': 'summary'},
+    'rmtree_threads_8': {'rmtree_threads': 8},
+}
+excluded_names = ['keep_%d.dat', 'tf%d.env', 'app_%d.cfg', '%02d_report.txt']
+exclude_list = ['keep_*.dat', 'tf*.env', '*.cfg', '[0-9][0-9]_report.txt', 'ops_files_purge.log']
+counted_os_calls = ['stat', 'lstat', 'scandir', 'listdir', 'remove', 'unlink', 'rmdir', 'rename']
+
+"""
+set_age(path,now,age): Sets both atime and mtime of path to now-age seconds
+"""
+def set_age(path,now,age):
+    os.utime(path,(now-age,now-age))
+
+"""
+build_sections(root,args,rng,now): Creates args.sections spool directories with args.files files each. args.excluded_ratio of the
+                                   files match the exclude list, args.old_ratio of them are older than 48 hours
+return: list of section paths
+"""
+def build_sections(root,args,rng,now):
+    sections = []
+    payload = b'x'*args.file_size
+    for i in range(args.sections):
+        section = os.path.join(root,'sections','spool%d' % i)
+        os.makedirs(section)
+        for j in range(args.files):
+            if rng.random() < args.excluded_ratio:
+                name = rng.choice(excluded_names) % j
+            else:
+                name = 'job_%07d.out' % j
+            path = os.path.join(section,name)
+            with open(path,'wb') as spool_file:
+                spool_file.write(payload)
+            if rng.random() < args.old_ratio:
+                set_age(path,now,rng.uniform(49*3600,30*86400))
+            else:
+                set_age(path,now,rng.uniform(0,47*3600))
+        sections.append(section)
+    return sections
+
+"""
+build_dirs(root,args,rng,now,depth): Creates a del_dirs() tree of args.fanout sub-directories per level down to args.depth levels.
+                                     args.digit_ratio of the names start with a digit (3/4 prefixed or other digits). Directory ages
+                                     are spread over older than 365 days, 31-364 days and younger than 30 days
+return: number of directories created
+"""
+def build_dirs(root,args,rng,now,depth=1):
+    created = 0
+    for i in range(args.fanout):
+        if rng.random() < args.digit_ratio:
+            name = '%d%04d_build' % (rng.randint(0,9),i)
+        else:
+            name = 'work_%04d' % i
+        path = os.path.join(root,name)
+        os.mkdir(path)
+        created += 1
+        for j in range(args.files_per_dir):
+            with open(os.path.join(path,'artifact_%d.o' % j),'wb') as artifact:
+                artifact.write(b'x'*args.file_size)
+        if depth < args.depth:
+            created += build_dirs(path,args,rng,now,depth+1)
+        set_age(path,now,rng.choice([rng.uniform(366,900),rng.uniform(31,364),rng.uniform(0,29)])*86400)
+    return created
+
+"""
+build_tree(args,seed): Builds one synthetic tree with its ops_files_purge_exceptions.cfg in a new temp directory
+return: dict describing the tree
+"""
+def build_tree(args,seed):
+    rng = random.Random(seed)
+    now = time.time()
+    root = tempfile.mkdtemp(prefix='purge_bench_',dir=args.tmp_dir)
+    sections = build_sections(root,args,rng,now)
+    dirs_root = os.path.join(root,'dirs')
+    os.mkdir(dirs_root)
+    no_of_dirs = build_dirs(dirs_root,args,rng,now)
+    config_file = os.path.join(root,'ops_files_purge_exceptions.cfg')
+    with open(config_file,'w') as config:
+        for section in sections:
+            config.write('[%s]\nfiles = %s\n\n' % (section,json.dumps(exclude_list)))
+    no_of_files = args.sections*args.files + no_of_dirs*args.files_per_dir
+    return {'root': root, 'config_file': config_file, 'dirs_root': dirs_root, 'files': no_of_files, 'dirs': no_of_dirs}
+
+"""
+count_os_calls(counts): Wraps the os functions in counted_os_calls so every call made by the purge is counted. Stats made through
+                        os.DirEntry are not visible here, they are reported by the purge itself (stat_calls)
+"""
+def count_os_calls(counts):
+    def counted(name,func):
+        def wrapper(*args,**kwargs):
+            counts[name] = counts.get(name,0)+1
+            return func(*args,**kwargs)
+        return wrapper
+    for name in counted_os_calls:
+        setattr(os,name,counted(name,getattr(os,name)))
+
+"""
+run_purge(tree,settings,results): Child process body. Runs one purge of the synthetic tree with the scenario settings and puts the
+                                  measurements on the results queue, or {'error': traceback} if the purge raised.
+                                  os_calls is the number of calls to the counted_os_calls wrappers of the os module (see
+                                  count_os_calls()), not of system calls: stats made through os.DirEntry are in stat_calls
+"""
+def run_purge(tree,settings,results):
+    try:
+        purger = Purger(base_path=tree['root'],config_file=tree['config_file'],dirs_to_del_list=[tree['dirs_root']],**settings)
+        os_call_counts = {}
+        count_os_calls(os_call_counts)
+        started = time.perf_counter()
+        outcome = purger.run()
+        wall = time.perf_counter()-started
+    except Exception:
+        results.put({'error': traceback.format_exc()})
+        return
+    results.put({
+        'wall_s': wall,
+        'files_per_s': tree['files']/wall if wall else 0.0,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'os_call_counts': os_call_counts,
+        'os_calls': sum(os_call_counts.values()),
+        'stat_calls': sum(result['stat_calls'] for result in outcome['sections']),
+        'files_deleted': sum(result['deleted'] for result in outcome['sections']),
+        'dirs_deleted': len(outcome['deleted_dirs']),
+    })
+
+"""
+run_scenario(args,name,settings): Builds a fresh tree for every repeat (build time is not measured) and runs the purge on it. The
+                                  tree is removed even when the run fails
+return: dict with the median of every measurement and the individual runs
+raise: RuntimeError if the purge raised or the child process died without a result
+"""
+def run_scenario(args,name,settings):
+    runs = []
+    context = multiprocessing.get_context('fork')
+    for repeat in range(args.repeat):
+        tree = build_tree(args,args.seed+repeat)
+        try:
+            results = context.Queue()
+            child = context.Process(target=run_purge,args=(tree,settings,results))
+            child.start()
+            run = wait_result(child,results)
+            if run is None:
+                raise RuntimeError('scenario %s: the benchmark process exited with code %s without a result' % (name,child.exitcode))
+            if 'error' in run:
+                raise RuntimeError('scenario %s: the purge failed\n%s' % (name,run['error']))
+            run.update(tree_files=tree['files'], tree_dirs=tree['dirs'])
+            runs.append(run)
+        finally:
+            shutil.rmtree(tree['root'],ignore_errors=True)
+    summary = {'settings': settings, 'runs': runs}
+    for key in ['wall_s','files_per_s','peak_rss_kb','os_calls','stat_calls','files_deleted','dirs_deleted']:
+        summary[key] = statistics.median(run[key] for run in runs)
+    return summary
+
+"""
+wait_result(child,results): Waits for the result of the child process, checking every second that it is still alive
+return: the result, or None if the child exited without one (killed, crashed interpreter)
+"""
+def wait_result(child,results):
+    while True:
+        try:
+            run = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if not child.is_alive():
+                try:
+                    run = results.get(timeout=1)
+                except queue.Empty:
+                    run = None
+                break
+    child.join()
+    return run
+
+"""
+code_version(): Short git commit of the tree being benchmarked
+return: commit id or "unknown"
+"""
+def code_version():
+    try:
+        return subprocess.check_output(['git','rev-parse','--short','HEAD'],cwd=os.path.dirname(os.path.abspath(__file__)),stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+"""
+print_results(results,baseline): Prints one line per scenario, with the change against the baseline results when given
+"""
+def print_results(results,baseline=None):
+    print(seperator1)
+    print('%-20s %10s %12s %12s %10s %12s %10s' % ('scenario','wall s','files/s','os calls','stats','peak RSS kB','vs base'))
+    print(seperator1)
+    for name,summary in results['scenarios'].items():
+        compared = ''
+        if baseline is not None and name in baseline['scenarios']:
+            compared = '%.2fx' % (baseline['scenarios'][name]['wall_s']/summary['wall_s'])
+        print('%-20s %10.3f %12.0f %12d %10d %12d %10s' % (name,summary['wall_s'],summary['files_per_s'],summary['os_calls'],summary['stat_calls'],summary['peak_rss_kb'],compared))
+    print(seperator1)
+    if baseline is not None:
+        print('vs base: speed-up of wall time against %s (version %s)' % (baseline.get('file'),baseline.get('version')))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark ops_purge on synthetic directory trees')
+    parser.add_argument('--sections',type=int,default=2,help='number of config sections (spool directories)')
+    parser.add_argument('--files',type=int,default=5000,help='files per section')
+    parser.add_argument('--old-ratio',type=float,default=0.5,help='fraction of section files older than 48 hours')
+    parser.add_argument('--excluded-ratio',type=float,default=0.2,help='fraction of section files matching the exclude list')
+    parser.add_argument('--file-size',type=int,default=64,help='bytes written to every file')
+    parser.add_argument('--depth',type=int,default=3,help='levels of the del_dirs() tree')
+    parser.add_argument('--fanout',type=int,default=4,help='sub-directories per directory in the del_dirs() tree')
+    parser.add_argument('--files-per-dir',type=int,default=20,help='files in every directory of the del_dirs() tree')
+    parser.add_argument('--digit-ratio',type=float,default=0.7,help='fraction of del_dirs() directory names starting with a digit')
+    parser.add_argument('--repeat',type=int,default=3,help='runs per scenario, the median is reported')
+    parser.add_argument('--seed',type=int,default=1,help='random seed of the tree generator')
+    parser.add_argument('--tmp-dir',default=None,help='where the synthetic trees are built (default: system temp dir)')
+    parser.add_argument('--scenario',action='append',default=[],help='NAME=JSON Purger settings, replaces the default scenarios')
+    parser.add_argument('--output',default=None,help='write the results to this JSON file')
+    parser.add_argument('--compare',default=None,help='JSON results of an earlier run to compare with')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = default_scenarios
+    if args.scenario:
+        scenarios = dict((name,json.loads(settings)) for name,settings in (scenario.split('=',1) for scenario in args.scenario))
+    results = {
+        'version': code_version(),
+        'created': time.time(),
+        'python': platform.python_version(),
+        'host': platform.node(),
+        'params': dict((key,value) for key,value in vars(args).items() if key not in ('scenario','output','compare')),
+        'scenarios': {},
+    }
+    try:
+        for name,settings in scenarios.items():
+            results['scenarios'][name] = run_scenario(args,name,settings)
+    except RuntimeError as e:
+        print('Benchmark aborted, %s' % e, file=sys.stderr)
+        return 1
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        baseline['file'] = args.compare
+    print_results(results,baseline)
+    if args.output:
+        with open(args.output,'w') as output:
+            json.dump(results,output,indent=1,sort_keys=True)
+
+if __name__ == "__main__":
+    sys.exit(main())